@@ -1,29 +1,576 @@
-from flask import Flask, request, abort, jsonify
+import base64
+import binascii
+from datetime import date
+from functools import wraps
+import hashlib
+import hmac
+import json
+import os
+import re
+
+from flask import Flask, Response, request, abort, current_app, g, jsonify, make_response, stream_with_context
 from flask_cors import CORS
-from sqlalchemy.exc import IntegrityError
-
-from auth.auth import AuthError, requires_auth
-from models import setup_db, Movie, Actor, Casting
+from sqlalchemy import column, func, literal, literal_column, or_, select, table, tuple_, union_all
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import selectinload
+
+from auth.auth import jwks_store, requires_auth, token_cache
+from cache import entity_cache
+from json_provider import FastJSONProvider
+import metrics
+from models import (setup_db, bulk_insert, delete_returning, get_row_counts, get_versions, on_replica,
+                    record_pool_metrics, update_returning, db, Movie, Actor, Casting, BULK_INSERT_CHUNK_SIZE,
+                    SEARCH_CONFIG)
+import query_budgets
+from query_budgets import query_budget
 
 ITEMS_PER_PAGE = 10
-
-
-def paginate(_request, selection):
+# Search terms beyond this number are ignored.
+MAX_SEARCH_TERMS = 8
+# Maximum number of items accepted by a bulk create request.
+MAX_BULK_ITEMS = 1000
+# INSERT statements of the largest bulk create request (see models.bulk_insert).
+MAX_BULK_INSERT_CHUNKS = -(-MAX_BULK_ITEMS // BULK_INSERT_CHUNK_SIZE)
+# Default and maximum number of records of the /stats top lists.
+STATS_TOP_N = 10
+MAX_STATS_TOP_N = 100
+
+# Rows fetched per round-trip by the streaming exports.
+EXPORT_BATCH_SIZE = 1000
+
+# Bump when the JSON representation of records changes, so old ETags stop matching.
+REPRESENTATION_VERSION = 2
+
+# Required fields of the create endpoints.
+ACTOR_FIELDS = {'name', 'age', 'gender'}
+MOVIE_FIELDS = {'title', 'release_date'}
+CAST_FIELDS = {'movie_id', 'actor_id'}
+
+# Movie release dates are ISO 8601 date strings, in every create and update request.
+RELEASE_DATE_ERROR = 'Movie release_date must be a date (E.g.: 1994-10-04)'
+
+# Filter query parameters per list endpoint.
+ACTOR_FILTERS = ('gender', 'min_age', 'max_age', 'name')
+MOVIE_FILTERS = ('release_date_from', 'release_date_to', 'title')
+
+# Whitelisted ?sort= fields per list endpoint.
+ACTOR_SORT_FIELDS = {
+    'id': Actor.id,
+    'name': Actor.name,
+    'age': Actor.age,
+    'gender': Actor.gender
+}
+MOVIE_SORT_FIELDS = {
+    'id': Movie.id,
+    'title': Movie.title,
+    'release_date': Movie.release_date
+}
+
+
+def conditional(*tables, included=()):
+    """Decorator for GET endpoints whose response only depends on the request and on `tables`.
+
+    The ETag is derived from the request path and query and the change versions of
+    `tables` (see models.bump_versions), plus those of `included` when the request
+    embeds related records with ?include=. A request whose If-None-Match holds the
+    current ETag gets 304 Not Modified before any record is loaded. Responses may
+    only be cached privately and must be revalidated, since they depend on the
+    permissions of the bearer token.
+    """
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            names = tables + (included if request.args.get('include') else ())
+            versions = get_versions(*names)
+            # Read by get_formatted, so cached records match the ETag.
+            g.table_versions = dict(zip(names, versions))
+            etag = hashlib.sha1(
+                f'{REPRESENTATION_VERSION}|{request.full_path}|{versions}'.encode()
+            ).hexdigest()
+
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Authorization')
+            return response
+
+        return wrapper
+
+    return conditional_decorator
+
+
+def read_replica(f):
+    """Decorator for read-only endpoints, whose queries may go to a read replica.
+
+    Has no effect unless DATABASE_REPLICA_URLS is set. The request reads from one
+    replica throughout (see models.RoutingSession), and from the primary once it
+    writes. When the replica can't be reached, it is left out for a while and the
+    request is retried once on the primary. Streaming responses can't be retried
+    once started.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        g.read_replica = True
+        try:
+            return f(*args, **kwargs)
+        except OperationalError:
+            if not on_replica():
+                raise
+            current_app.logger.warning('Read replica failed, retrying on the primary.', exc_info=True)
+            db.session.rollback()
+            db.session.info.pop('replica', None)
+            g.read_replica = False
+            return f(*args, **kwargs)
+
+    return wrapper
+
+
+def get_formatted(model, record_id, include=()):
+    """Returns the formatted record of `model` by id, read through the entity cache, or None.
+
+    Records are cached under the change version of their table, as read by
+    `conditional` for the ETag (or read here otherwise), so a record loaded before a
+    write is never served with an ETag from after it. Invalidation is table-wide:
+    any write to the table leaves all its cached records behind. Records with embedded related
+    records (see get_include) are loaded eagerly, in a second query, and not cached.
+    """
+    def load():
+        selection = model.query.options(*include_options(model, include))
+        record = selection.filter(model.id == record_id).one_or_none()
+        return record.format(include) if record is not None else None
+
+    if include:
+        return load()
+    kind = model.__tablename__
+    version = g.get('table_versions', {}).get(kind)
+    if version is None:
+        version = get_versions(kind)[0]
+    # Also safe on a lagging replica: its records are cached under its own, older, versions.
+    return entity_cache.get_or_load(kind, version, record_id, load)
+
+
+def get_include(_request, allowed):
+    """Returns the related records to embed, from the comma separated include query parameter."""
+    include = tuple(x for x in _request.args.get('include', '').split(',') if x)
+    for name in include:
+        if name not in allowed:
+            abort(400, f'Invalid include: {name}')
+    return include
+
+
+def include_options(model, include):
+    """Returns the loader options that load the relationships in `include` with one query each."""
+    return [selectinload(getattr(model, x)) for x in include]
+
+
+def paginate(_request, selection, include=(), total=None):
+    """Returns the requested page of formatted records and the total number of records.
+
+    Only the requested page is fetched (LIMIT/OFFSET) and the total is computed
+    by a window count in the same statement, unless `total` is already known
+    (E.g.: from the maintained row counts). Relationships in `include` must be
+    eagerly loaded by `selection`.
+    """
     page = _request.args.get('page', 1, type=int)
+    if page < 1:
+        return [], 0
     start = (page - 1) * ITEMS_PER_PAGE
-    end = start + ITEMS_PER_PAGE
 
-    records = [rec.format() for rec in selection]
-    current_records = records[start:end]
+    if total is not None:
+        records = [rec.format(include) for rec in selection.limit(ITEMS_PER_PAGE).offset(start).all()]
+        return records, total
+
+    rows = selection.add_columns(func.count().over()).limit(ITEMS_PER_PAGE).offset(start).all()
+    records = [rec.format(include) for rec, _ in rows]
+    total = rows[0][1] if rows else 0
+
+    return records, total
+
+
+def get_filter_arg(_request, name, parse):
+    """Returns the parsed value of a filter query parameter, or None if it wasn't given."""
+    value = _request.args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return parse(value)
+    except ValueError:
+        abort(400, f'Invalid value for filter: {name}')
+
+
+def prefix_pattern(prefix):
+    """Returns a LIKE pattern matching values that start with `prefix`."""
+    prefix = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'{prefix}%'
+
+
+def is_filtered(_request, filters):
+    """Returns whether the request has a value for any of the `filters` query parameters."""
+    return any(_request.args.get(x) for x in filters)
+
+
+def filter_actors(_request, selection):
+    """Applies the gender, min_age, max_age and name prefix filters of the request."""
+    gender = get_filter_arg(_request, 'gender', str)
+    min_age = get_filter_arg(_request, 'min_age', int)
+    max_age = get_filter_arg(_request, 'max_age', int)
+    name = get_filter_arg(_request, 'name', str)
+
+    if gender is not None:
+        selection = selection.filter(Actor.gender == gender)
+    if min_age is not None:
+        selection = selection.filter(Actor.age >= min_age)
+    if max_age is not None:
+        selection = selection.filter(Actor.age <= max_age)
+    if name is not None:
+        selection = selection.filter(Actor.name.like(prefix_pattern(name), escape='\\'))
+
+    return selection
+
+
+def filter_movies(_request, selection):
+    """Applies the release_date_from, release_date_to and title prefix filters of the request."""
+    release_date_from = get_filter_arg(_request, 'release_date_from', date.fromisoformat)
+    release_date_to = get_filter_arg(_request, 'release_date_to', date.fromisoformat)
+    title = get_filter_arg(_request, 'title', str)
+
+    if release_date_from is not None:
+        selection = selection.filter(Movie.release_date >= release_date_from)
+    if release_date_to is not None:
+        selection = selection.filter(Movie.release_date <= release_date_to)
+    if title is not None:
+        selection = selection.filter(Movie.title.like(prefix_pattern(title), escape='\\'))
+
+    return selection
+
+
+def sort_order(_request, fields, default):
+    """Returns the ORDER BY clauses for the ?sort= parameter (e.g. `-age,name`).
+
+    Only the given whitelisted `fields` may be used; `id` is always appended
+    as a tie-breaker so pages are stable.
+    """
+    sort = _request.args.get('sort')
+    if not sort:
+        return default
+
+    order = []
+    keys = set()
+    for key in sort.split(','):
+        key = key.strip()
+        descending = key.startswith('-')
+        key = key.lstrip('-')
+        if key not in fields or key in keys:
+            abort(400, f'Invalid sort field: {key}')
+        keys.add(key)
+        order.append(null_order(fields[key], descending))
+    if 'id' not in keys:
+        order.append(fields['id'].asc())
+
+    return order
+
+
+def encode_cursor(values):
+    """Encodes the sort key values of a record into an opaque cursor string."""
+    values = [x.isoformat() if isinstance(x, date) else x for x in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Decodes a cursor string back into sort key values for `columns`."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(cursor)
+        return [
+            date.fromisoformat(value) if value is not None and column.type.python_type is date else value
+            for column, value in zip(columns, values)
+        ]
+    except (binascii.Error, TypeError, ValueError):
+        abort(400, 'Invalid cursor.')
+
+
+def paginate_cursor(_request, selection, sort_column, id_column, descending=False, include=()):
+    """Returns a page of formatted records after the request cursor and the cursor of the next page.
+
+    Records are ordered by `sort_column`, then `id_column` as a tie-breaker, and the
+    page is located with a keyset condition on those columns instead of OFFSET, so
+    every page costs the same however deep it is. NULL sort values count as the
+    largest (see null_order), so both directions are a plain scan of a (sort, id)
+    index. Records with a NULL sort value and the others are paged as two separate
+    ranges, each with its own index-backed condition; a page that reaches the end of
+    the first range is completed from the second. The next cursor is None on the
+    last page.
+    """
+    columns = [sort_column] if sort_column is id_column else [sort_column, id_column]
+    order = [null_order(x, descending) for x in columns]
+    selection = selection.order_by(None)
+    cursor = _request.args.get('cursor')
+    values = decode_cursor(cursor, columns) if cursor else None
+
+    if len(columns) == 1:
+        if values is not None:
+            selection = selection.filter(id_column < values[0] if descending else id_column > values[0])
+        ranges = [selection]
+    elif values is None:
+        ranges = [selection]
+    else:
+        nulls = selection.filter(sort_column.is_(None))
+        not_nulls = selection.filter(sort_column.isnot(None))
+        if values[0] is None:
+            nulls = nulls.filter(id_column < values[1] if descending else id_column > values[1])
+        else:
+            compare = tuple_(*columns).__lt__ if descending else tuple_(*columns).__gt__
+            not_nulls = not_nulls.filter(compare(tuple_(*values)))
+        # Descending, the NULL range comes first.
+        ranges = [nulls, not_nulls] if descending else [not_nulls, nulls]
+        if (values[0] is None) != descending:
+            # The cursor is in the second range: the first one is done.
+            ranges = ranges[1:]
+
+    rows = []
+    for part in ranges:
+        rows += part.order_by(*order).limit(ITEMS_PER_PAGE + 1 - len(rows)).all()
+        if len(rows) > ITEMS_PER_PAGE:
+            break
+
+    next_cursor = None
+    if len(rows) > ITEMS_PER_PAGE:
+        rows = rows[:ITEMS_PER_PAGE]
+        next_cursor = encode_cursor([getattr(rows[-1], x.key) for x in columns])
+
+    return [rec.format(include) for rec in rows], next_cursor
+
+
+def null_order(column, descending=False):
+    """Returns the ORDER BY clause of `column`, with NULL as the largest value on every database.
+
+    That is Postgres' own order, so an ascending index serves it in both directions.
+    """
+    return column.desc().nullsfirst() if descending else column.asc().nullslast()
+
+
+def search_selects(dialect, terms, query):
+    """Returns one ranked SELECT (type, id, name, rank) per searchable table.
+
+    Postgres matches the terms as prefixes against the tsvector index and also
+    accepts fuzzy matches through trigram similarity. SQLite matches prefixes
+    against the FTS5 tables.
+    """
+    selects = []
+    for kind, model, text_column in (('movie', Movie, Movie.title), ('actor', Actor, Actor.name)):
+        if dialect == 'postgresql':
+            config = literal_column(f"'{SEARCH_CONFIG}'")
+            vector = func.to_tsvector(config, text_column)
+            ts_query = func.to_tsquery(config, ' & '.join(f'{x}:*' for x in terms))
+            rank = func.greatest(func.ts_rank(vector, ts_query), func.similarity(text_column, query))
+            selects.append(
+                select(literal(kind).label('type'), model.id, text_column.label('name'), rank.label('rank'))
+                .where(or_(vector.op('@@')(ts_query), text_column.op('%')(query)))
+            )
+        else:
+            fts = table(f'{model.__tablename__}_fts', column('rowid'))
+            fts_query = ' '.join(f'"{x}"*' for x in terms)
+            rank = -func.bm25(literal_column(fts.name))
+            selects.append(
+                select(literal(kind).label('type'), model.id, text_column.label('name'), rank.label('rank'))
+                .select_from(fts.join(model, model.id == fts.c.rowid))
+                .where(literal_column(fts.name).op('MATCH')(fts_query))
+            )
+    return selects
+
+
+def search_catalog(_request, query):
+    """Returns the requested page of ranked movies and actors matching `query`, and the total."""
+    page = _request.args.get('page', 1, type=int)
+    terms = re.findall(r'\w+', query)[:MAX_SEARCH_TERMS]
+    if page < 1 or not terms:
+        return [], 0
+
+    selects = search_selects(db.engine.dialect.name, terms, query)
+    results = union_all(*selects).subquery()
+    rows = db.session.execute(
+        select(results, func.count().over().label('total'))
+        .order_by(results.c.rank.desc(), results.c.type, results.c.id)
+        .limit(ITEMS_PER_PAGE)
+        .offset((page - 1) * ITEMS_PER_PAGE)
+    ).all()
+
+    records = [{
+        'type': row.type,
+        'id': row.id,
+        'title' if row.type == 'movie' else 'name': row.name,
+        'rank': round(float(row.rank), 6)
+    } for row in rows]
+    total = rows[0].total if rows else 0
+
+    return records, total
+
+
+def counter_summary(model, counter, limit):
+    """Returns the top `limit` records of `model` by `counter`, and the distribution of its values.
+
+    Both are read from the maintained counter column (and its index), not from casting.
+    """
+    top = (model.query
+           .order_by(counter.desc(), model.id.desc())
+           .limit(limit)
+           .all())
+    distribution = db.session.execute(
+        select(counter, func.count())
+        .group_by(counter)
+        .order_by(counter)
+    ).all()
+
+    return (
+        [dict(rec.format(), **{counter.key: getattr(rec, counter.key)}) for rec in top],
+        [{counter.key: value, 'count': count} for value, count in distribution]
+    )
+
+
+def export_ndjson(model):
+    """Returns a streaming response with every record of `model` as newline-delimited JSON.
+
+    Rows are read in id order through a server-side cursor (yielded EXPORT_BATCH_SIZE
+    at a time), so memory stays flat whatever the table size and the first rows are
+    sent as soon as the first batch arrives.
+    """
+    def generate():
+        dumps = current_app.json.dumps
+        result = db.session.execute(
+            select(model.__table__)
+            .order_by(model.id)
+            .execution_options(stream_results=True, max_row_buffer=EXPORT_BATCH_SIZE)
+        )
+        # format() only reads column attributes, which the rows have too.
+        for rows in result.partitions(EXPORT_BATCH_SIZE):
+            yield ''.join(dumps(model.format(row)) + '\n' for row in rows)
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename={model.__tablename__}.ndjson'
+    response.headers['Cache-Control'] = 'private, no-store'
+    return response
+
+
+def check_fields(body, required_fields, label):
+    """Returns an error message if a required field of `body` is missing or empty, otherwise None."""
+    missing_fields = required_fields.difference(body)
+    if missing_fields:
+        return f'Missing required {label.lower()} field(s): {", ".join(missing_fields)}'
+    empty_fields = set(x for x in body if not body.get(x))
+    empty_required_fields = required_fields.intersection(empty_fields)
+    if empty_required_fields:
+        return f'{label} field(s) cannot be empty: {", ".join(empty_required_fields)}'
+    return None
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_actor(item):
+    """Validates a bulk actor item. Returns (row, None) or (None, error message)."""
+    error = check_fields(item, ACTOR_FIELDS, 'Actor')
+    if error:
+        return None, error
+    if not isinstance(item['name'], str):
+        return None, 'Actor name must be a string'
+    if not is_int(item['age']):
+        return None, 'Actor age must be an integer'
+    if not isinstance(item['gender'], str) or len(item['gender']) != 1:
+        return None, 'Actor gender must be a single character'
+    return {'name': item['name'], 'age': item['age'], 'gender': item['gender']}, None
+
+
+def parse_release_date(value):
+    """Returns the ISO 8601 date string `value` (E.g.: 1994-10-04) as a date, or None if it isn't one."""
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_movie(item):
+    """Validates a bulk movie item. Returns (row, None) or (None, error message)."""
+    error = check_fields(item, MOVIE_FIELDS, 'Movie')
+    if error:
+        return None, error
+    if not isinstance(item['title'], str) or len(item['title']) > Movie.title.type.length:
+        return None, f'Movie title must be a string of at most {Movie.title.type.length} characters'
+    release_date = parse_release_date(item['release_date'])
+    if release_date is None:
+        return None, RELEASE_DATE_ERROR
+    return {'title': item['title'], 'release_date': release_date}, None
+
+
+def parse_casting(item):
+    """Validates a bulk casting item. Returns (row, None) or (None, error message)."""
+    error = check_fields(item, CAST_FIELDS, 'Cast')
+    if error:
+        return None, error
+    if not is_int(item['movie_id']) or not is_int(item['actor_id']):
+        return None, 'Cast movie_id and actor_id must be integers'
+    return {'movie_id': item['movie_id'], 'actor_id': item['actor_id']}, None
+
+
+def parse_bulk(_request, parse_item):
+    """Validates every item of a bulk create request body (a JSON array).
+
+    Returns the valid rows keyed by item index, and a list of per-item errors.
+    """
+    body = _request.get_json()
+    if not isinstance(body, list) or not body:
+        abort(400, 'Request body must be a non-empty array.')
+    if len(body) > MAX_BULK_ITEMS:
+        abort(400, f'At most {MAX_BULK_ITEMS} items can be created per request.')
+
+    rows = {}
+    errors = []
+    for index, item in enumerate(body):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'message': 'Item must be an object'})
+            continue
+        row, error = parse_item(item)
+        if error:
+            errors.append({'index': index, 'message': error})
+        else:
+            rows[index] = row
+
+    return rows, errors
+
+
+def bulk_response(size, created, errors):
+    """Returns the bulk create response, with `created_ids` aligned with the request items."""
+    created_ids = [created.get(index) for index in range(size)]
+    errors = sorted(errors, key=lambda x: x['index'])
+    if not created:
+        return jsonify({
+            'success': False,
+            'error': 400,
+            'message': 'No valid items to create.',
+            'created_ids': created_ids,
+            'errors': errors
+        }), 400
 
-    return current_records
+    return jsonify({
+        'success': True,
+        'created_ids': created_ids,
+        'errors': errors
+    }), 201
 
 
 def create_app(test_config=None):
     """Create and configures the app."""
     app = Flask(__name__)
+    app.json = FastJSONProvider(app)
     with app.app_context():
         setup_db(app)
+    metrics.init_app(app)
+    query_budgets.init_app(app)
 
     # Allow '*' for origins.
     CORS(app)
@@ -35,11 +582,47 @@ def create_app(test_config=None):
         response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
         return response
 
+    @app.route('/metrics', methods=['GET'])
+    @query_budget(0)
+    def get_metrics():
+        # Scraped by Prometheus, which has no Auth0 token. Disabled unless METRICS_TOKEN is set.
+        token = os.environ.get('METRICS_TOKEN')
+        if not token:
+            abort(404)
+        authorization = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+            abort(401, 'Invalid metrics token.')
+
+        record_pool_metrics()
+        metrics.record_cache_metrics({'entity': entity_cache, 'token': token_cache})
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
     @app.route('/actors', methods=['GET'])
+    @query_budget(4)
     @requires_auth('get:actors')
+    @read_replica
+    @conditional('actor', included=('movie', 'casting'))
     def get_actors(payload):
-        selection = Actor.query.order_by(Actor.id).all()
-        actors = paginate(request, selection)
+        include = get_include(request, ('movies',))
+        selection = filter_actors(request, Actor.query.options(*include_options(Actor, include)))
+
+        if 'cursor' in request.args:
+            if 'sort' in request.args:
+                abort(400, 'Cursor pagination does not support sort.')
+            actors, next_cursor = paginate_cursor(request, selection, Actor.id, Actor.id, include=include)
+
+            if len(actors) == 0:
+                abort(404)
+
+            return jsonify({
+                'success': True,
+                'actors': actors,
+                'next_cursor': next_cursor
+            })
+
+        order = sort_order(request, ACTOR_SORT_FIELDS, [Actor.id])
+        total = None if is_filtered(request, ACTOR_FILTERS) else get_row_counts('actor')[0]
+        actors, total_actors = paginate(request, selection.order_by(*order), include, total)
 
         if len(actors) == 0:
             abort(404)
@@ -47,14 +630,36 @@ def create_app(test_config=None):
         return jsonify({
             'success': True,
             'actors': actors,
-            'total_actors': len(selection)
+            'total_actors': total_actors
         })
 
     @app.route('/movies', methods=['GET'])
+    @query_budget(5)
     @requires_auth('get:movies')
+    @read_replica
+    @conditional('movie', included=('actor', 'casting'))
     def get_movies(payload):
-        selection = Movie.query.order_by(Movie.release_date.desc()).all()
-        movies = paginate(request, selection)
+        include = get_include(request, ('actors',))
+        selection = filter_movies(request, Movie.query.options(*include_options(Movie, include)))
+
+        if 'cursor' in request.args:
+            if 'sort' in request.args:
+                abort(400, 'Cursor pagination does not support sort.')
+            movies, next_cursor = paginate_cursor(request, selection, Movie.release_date, Movie.id,
+                                                  descending=True, include=include)
+
+            if len(movies) == 0:
+                abort(404)
+
+            return jsonify({
+                'success': True,
+                'movies': movies,
+                'next_cursor': next_cursor
+            })
+
+        order = sort_order(request, MOVIE_SORT_FIELDS, [null_order(Movie.release_date, True), Movie.id.desc()])
+        total = None if is_filtered(request, MOVIE_FILTERS) else get_row_counts('movie')[0]
+        movies, total_movies = paginate(request, selection.order_by(*order), include, total)
 
         if len(movies) == 0:
             abort(404)
@@ -62,94 +667,174 @@ def create_app(test_config=None):
         return jsonify({
             'success': True,
             'movies': movies,
-            'total_movies': len(selection)
+            'total_movies': total_movies
         })
 
     @app.route('/movies/<int:movie_id>', methods=['GET'])
+    @query_budget(3)
     @requires_auth('get:movies')
+    @read_replica
+    @conditional('movie', included=('actor', 'casting'))
     def get_movie_by_id(payload, movie_id):
-        movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
+        movie = get_formatted(Movie, movie_id, get_include(request, ('actors',)))
 
         if not movie:
             abort(404)
 
         return jsonify({
             'success': True,
-            'movie': movie.format()
+            'movie': movie
         })
 
     @app.route('/actors/<int:actor_id>', methods=['GET'])
+    @query_budget(3)
     @requires_auth('get:actors')
+    @read_replica
+    @conditional('actor', included=('movie', 'casting'))
     def get_actor_by_id(payload, actor_id):
-        actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
+        actor = get_formatted(Actor, actor_id, get_include(request, ('movies',)))
 
         if not actor:
             abort(404)
 
         return jsonify({
             'success': True,
-            'actor': actor.format()
+            'actor': actor
         })
 
     @app.route('/actors/<int:actor_id>/movies', methods=['GET'])
+    @query_budget(3)
     @requires_auth('get:movies')
+    @read_replica
+    @conditional('actor', 'movie', 'casting')
     def get_movies_by_actor(payload, actor_id):
-        actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
+        actor = get_formatted(Actor, actor_id)
 
         if not actor:
             abort(404)
 
-        selection = [x.movie for x in actor.casting]
-        selection = sorted(selection, key=lambda x: x.release_date, reverse=True)
-        movies = paginate(request, selection)
+        selection = (Movie.query
+                     .join(Casting, Casting.movie_id == Movie.id)
+                     .filter(Casting.actor_id == actor_id)
+                     .order_by(null_order(Movie.release_date, True), Movie.id.desc()))
+        movies, total_movies = paginate(request, selection)
 
         if len(movies) == 0:
             abort(404)
 
         return jsonify({
             'success': True,
-            'actor': actor.format(),
+            'actor': actor,
             'movies': movies,
-            'total_movies': len(selection)
+            'total_movies': total_movies
         })
 
     @app.route('/movies/<int:movie_id>/actors', methods=['GET'])
+    @query_budget(3)
     @requires_auth('get:actors')
+    @read_replica
+    @conditional('movie', 'actor', 'casting')
     def get_actors_by_movie(payload, movie_id):
-        movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
+        movie = get_formatted(Movie, movie_id)
 
         if not movie:
             abort(404)
 
-        selection = [x.actor for x in movie.casting]
-        selection = sorted(selection, key=lambda x: x.id)
-        actors = paginate(request, selection)
+        selection = (Actor.query
+                     .join(Casting, Casting.actor_id == Actor.id)
+                     .filter(Casting.movie_id == movie_id)
+                     .order_by(Actor.id))
+        actors, total_actors = paginate(request, selection)
 
         if len(actors) == 0:
             abort(404)
 
         return jsonify({
             'success': True,
-            'movie': movie.format(),
+            'movie': movie,
             'actors': actors,
-            'total_actors': len(actors)
+            'total_actors': total_actors
+        })
+
+    @app.route('/search', methods=['GET'])
+    @query_budget(2)
+    @requires_auth(['get:movies', 'get:actors'])
+    @read_replica
+    @conditional('movie', 'actor')
+    def search(payload):
+        query = request.args.get('q', '').strip()
+        if not query:
+            abort(400, 'A search query is required: q')
+
+        results, total_results = search_catalog(request, query)
+
+        if len(results) == 0:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'results': results,
+            'total_results': total_results
+        })
+
+    @app.route('/stats', methods=['GET'])
+    @query_budget(6)
+    @requires_auth(['get:movies', 'get:actors'])
+    @read_replica
+    @conditional('movie', 'actor', 'casting')
+    def get_stats(payload):
+        limit = request.args.get('limit', STATS_TOP_N, type=int)
+        if not 1 <= limit <= MAX_STATS_TOP_N:
+            abort(400, f'limit must be between 1 and {MAX_STATS_TOP_N}')
+
+        total_movies, total_actors, total_castings = get_row_counts('movie', 'actor', 'casting')
+        top_movies, cast_count_distribution = counter_summary(Movie, Movie.cast_count, limit)
+        top_actors, credit_count_distribution = counter_summary(Actor, Actor.credit_count, limit)
+
+        return jsonify({
+            'success': True,
+            'total_movies': total_movies,
+            'total_actors': total_actors,
+            'total_castings': total_castings,
+            'average_cast_count': round(total_castings / total_movies, 2) if total_movies else 0,
+            'average_credit_count': round(total_castings / total_actors, 2) if total_actors else 0,
+            'top_movies': top_movies,
+            'top_actors': top_actors,
+            'cast_count_distribution': cast_count_distribution,
+            'credit_count_distribution': credit_count_distribution
         })
 
+    @app.route('/export/movies', methods=['GET'])
+    @query_budget(1)
+    @requires_auth('get:movies')
+    @read_replica
+    def export_movies(payload):
+        return export_ndjson(Movie)
+
+    @app.route('/export/actors', methods=['GET'])
+    @query_budget(1)
+    @requires_auth('get:actors')
+    @read_replica
+    def export_actors(payload):
+        return export_ndjson(Actor)
+
+    @app.route('/export/castings', methods=['GET'])
+    @query_budget(1)
+    @requires_auth(['get:movies', 'get:actors'])
+    @read_replica
+    def export_castings(payload):
+        return export_ndjson(Casting)
+
     @app.route('/actors', methods=['POST'])
+    @query_budget(3)
     @requires_auth('post:actors')
     def create_actor(payload):
         body = request.get_json()
 
-        # Check for required fields.
-        required_fields = {'name', 'age', 'gender'}
-        missing_fields = required_fields.difference(body)
-        if missing_fields:
-            abort(400, f'Missing required actor fields(s): {", ".join(missing_fields)}')
-        # Check for empty fields.
-        empty_fields = set(x for x in body if not body.get(x))
-        empty_required_fields = required_fields.intersection(empty_fields)
-        if empty_required_fields:
-            abort(400, f'Actor field(s) cannot be empty: {", ".join(empty_required_fields)}')
+        # Check for required and empty fields.
+        error = check_fields(body, ACTOR_FIELDS, 'Actor')
+        if error:
+            abort(400, error)
 
         try:
             actor = Actor(
@@ -166,25 +851,23 @@ def create_app(test_config=None):
             abort(422)
 
     @app.route('/movies', methods=['POST'])
+    @query_budget(3)
     @requires_auth('post:movies')
     def create_movie(payload):
         body = request.get_json()
 
-        # Check for required fields.
-        required_fields = {'title', 'release_date'}
-        missing_fields = required_fields.difference(body)
-        if missing_fields:
-            abort(400, f'Missing required movie field(s): {", ".join(missing_fields)}')
-        # Check for empty fields.
-        empty_fields = set(x for x in body if not body.get(x))
-        empty_required_fields = required_fields.intersection(empty_fields)
-        if empty_required_fields:
-            abort(400, f'Movie field(s) cannot be empty: {", ".join(empty_required_fields)}')
+        # Check for required and empty fields.
+        error = check_fields(body, MOVIE_FIELDS, 'Movie')
+        if error:
+            abort(400, error)
+        release_date = parse_release_date(body['release_date'])
+        if release_date is None:
+            abort(400, RELEASE_DATE_ERROR)
 
         try:
             movie = Movie(
                 title=body.get('title'),
-                release_date=body.get('release_date')
+                release_date=release_date
             )
             movie.insert()
             return jsonify({
@@ -195,37 +878,111 @@ def create_app(test_config=None):
             abort(422)
 
     @app.route('/castings', methods=['POST'])
+    @query_budget(2)
     @requires_auth('post:castings')
     def create_casting(payload):
         body = request.get_json()
 
-        # Check for required fields.
-        required_fields = {'movie_id', 'actor_id'}
-        missing_fields = required_fields.difference(body)
-        if missing_fields:
-            abort(400, f'Missing required cast field(s): {", ".join(missing_fields)}')
-        # Check for empty fields.
-        empty_fields = set(x for x in body if not body.get(x))
-        empty_required_fields = required_fields.intersection(empty_fields)
-        if empty_required_fields:
-            abort(400, f'Cast field(s) cannot be empty: {", ".join(empty_required_fields)}')
+        # Check for required and empty fields.
+        error = check_fields(body, CAST_FIELDS, 'Cast')
+        if error:
+            abort(400, error)
 
         try:
-            cast = Casting(
+            casting_id, created = Casting.insert_or_get(
                 movie_id=body.get('movie_id'),
                 actor_id=body.get('actor_id')
             )
-            cast.insert()
+            # Re-sending an existing pairing returns its id instead of failing.
             return jsonify({
                 'success': True,
-                'created_id': cast.id
-            }), 201
-        except IntegrityError:
-            abort(400, f'Casting already exists')
+                'created_id': casting_id,
+                'created': created
+            }), 201 if created else 200
+        except Exception:
+            db.session.rollback()
+            abort(422)
+
+    @app.route('/actors/bulk', methods=['POST'])
+    # The inserts, then the version bump.
+    @query_budget(MAX_BULK_INSERT_CHUNKS + 1)
+    @requires_auth('post:actors')
+    def create_actors_bulk(payload):
+        rows, errors = parse_bulk(request, parse_actor)
+
+        try:
+            created = dict(zip(rows, bulk_insert(Actor, list(rows.values()))))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            abort(422)
+
+        return bulk_response(len(rows) + len(errors), created, errors)
+
+    @app.route('/movies/bulk', methods=['POST'])
+    @query_budget(MAX_BULK_INSERT_CHUNKS + 1)
+    @requires_auth('post:movies')
+    def create_movies_bulk(payload):
+        rows, errors = parse_bulk(request, parse_movie)
+
+        try:
+            created = dict(zip(rows, bulk_insert(Movie, list(rows.values()))))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            abort(422)
+
+        return bulk_response(len(rows) + len(errors), created, errors)
+
+    @app.route('/castings/bulk', methods=['POST'])
+    # The movie and actor lookups, the inserts (on SQLite each followed by a read back
+    # of the written rows when some were skipped), then the version bump.
+    @query_budget(2 + 2 * MAX_BULK_INSERT_CHUNKS + 1)
+    @requires_auth('post:castings')
+    def create_castings_bulk(payload):
+        rows, errors = parse_bulk(request, parse_casting)
+
+        # Check references with one query per table instead of per item.
+        movie_ids = set(x['movie_id'] for x in rows.values())
+        actor_ids = set(x['actor_id'] for x in rows.values())
+        existing_movie_ids = set(db.session.scalars(select(Movie.id).where(Movie.id.in_(movie_ids))))
+        existing_actor_ids = set(db.session.scalars(select(Actor.id).where(Actor.id.in_(actor_ids))))
+
+        seen_pairs = set()
+        for index, row in list(rows.items()):
+            pair = (row['movie_id'], row['actor_id'])
+            if row['movie_id'] not in existing_movie_ids:
+                error = f'Movie not found: {row["movie_id"]}'
+            elif row['actor_id'] not in existing_actor_ids:
+                error = f'Actor not found: {row["actor_id"]}'
+            elif pair in seen_pairs:
+                error = 'Casting already exists'
+            else:
+                seen_pairs.add(pair)
+                continue
+            errors.append({'index': index, 'message': error})
+            del rows[index]
+
+        # Existing pairings, even ones committed concurrently, are skipped by the insert.
+        size = len(rows) + len(errors)
+        try:
+            ids = bulk_insert(Casting, list(rows.values()), unique_columns=['movie_id', 'actor_id'])
+            db.session.commit()
         except Exception:
+            db.session.rollback()
             abort(422)
 
+        created = {}
+        for index, casting_id in zip(rows, ids):
+            if casting_id is None:
+                errors.append({'index': index, 'message': 'Casting already exists'})
+            else:
+                created[index] = casting_id
+
+        return bulk_response(size, created, errors)
+
     @app.route('/actors/<int:actor_id>', methods=['PATCH'])
+    @query_budget(3)
     @requires_auth('patch:actors')
     def update_actor(payload, actor_id):
         body = request.get_json()
@@ -235,28 +992,23 @@ def create_app(test_config=None):
             if field in body and not body.get(field):
                 abort(400, f'A value is required for field: {field}')
 
-        actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
+        values = {x: body[x] for x in ['name', 'age', 'gender'] if x in body}
+        try:
+            actor = update_returning(Actor, actor_id, values)
+        except Exception:
+            db.session.rollback()
+            abort(422)
 
         if actor is None:
             abort(404)
 
-        try:
-            if 'name' in body:
-                actor.name = body['name']
-            if 'age' in body:
-                actor.age = body['age']
-            if 'gender' in body:
-                actor.gender = body['gender']
-            actor.update()
-
-            return jsonify({
-                'success': True,
-                'actor': actor.format()
-            })
-        except Exception:
-            abort(422)
+        return jsonify({
+            'success': True,
+            'actor': actor
+        })
 
     @app.route('/movies/<int:movie_id>', methods=['PATCH'])
+    @query_budget(3)
     @requires_auth('patch:movies')
     def update_movie(payload, movie_id):
         body = request.get_json()
@@ -266,76 +1018,79 @@ def create_app(test_config=None):
             if field in body and not body.get(field):
                 abort(400, f'A value is required for field: {field}')
 
-        movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
+        values = {x: body[x] for x in ['title', 'release_date'] if x in body}
+        if 'release_date' in values:
+            values['release_date'] = parse_release_date(values['release_date'])
+            if values['release_date'] is None:
+                abort(400, RELEASE_DATE_ERROR)
+        try:
+            movie = update_returning(Movie, movie_id, values)
+        except Exception:
+            db.session.rollback()
+            abort(422)
 
         if movie is None:
             abort(404)
 
-        try:
-            if 'title' in body:
-                movie.title = body['title']
-            if 'release_date' in body:
-                movie.release_date = body['release_date']
-            movie.update()
-
-            return jsonify({
-                'success': True,
-                'movie': movie.format()
-            })
-        except Exception:
-            abort(422)
+        return jsonify({
+            'success': True,
+            'movie': movie
+        })
 
     @app.route('/actors/<int:actor_id>', methods=['DELETE'])
+    @query_budget(2)
     @requires_auth('delete:actors')
     def delete_actors(payload, actor_id):
-        actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
-
-        if actor is None:
-            abort(422)
-
         try:
-            actor.delete()
-            return jsonify({
-                'success': True,
-                'deleted_id': actor_id
-            })
+            deleted = delete_returning(Actor, actor_id)
         except Exception:
+            db.session.rollback()
             abort(422)
 
+        if not deleted:
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'deleted_id': actor_id
+        })
+
     @app.route('/movies/<int:movie_id>', methods=['DELETE'])
+    @query_budget(2)
     @requires_auth('delete:movies')
     def delete_movies(payload, movie_id):
-        movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
-
-        if movie is None:
-            abort(422)
-
         try:
-            movie.delete()
-            return jsonify({
-                'success': True,
-                'deleted_id': movie_id
-            })
+            deleted = delete_returning(Movie, movie_id)
         except Exception:
+            db.session.rollback()
             abort(422)
 
+        if not deleted:
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'deleted_id': movie_id
+        })
+
     @app.route('/castings/<int:casting_id>', methods=['DELETE'])
+    @query_budget(2)
     @requires_auth('delete:castings')
     def delete_casting(payload, casting_id):
-        casting = Casting.query.filter(Casting.id == casting_id).one_or_none()
-
-        if casting is None:
-            abort(422)
-
         try:
-            casting.delete()
-            return jsonify({
-                'success': True,
-                'deleted_id': casting_id
-            })
+            deleted = delete_returning(Casting, casting_id)
         except Exception:
+            db.session.rollback()
+            abort(422)
+
+        if not deleted:
             abort(422)
 
+        return jsonify({
+            'success': True,
+            'deleted_id': casting_id
+        })
+
     #############################################################################
     # Error handlers
     #############################################################################
@@ -398,9 +1153,47 @@ def create_app(test_config=None):
     return app
 
 
-app = create_app()
+def warm_up(app, connections=True, jwks=True):
+    """Prepares the app for its first requests, instead of making them pay for it.
+
+    Opens the connections of the database pool, so the first requests don't wait
+    for connection setup, and fetches the Auth0 key set. Failures are logged, not
+    raised: the work is then simply done by the first requests, as without warm-up.
+    With gunicorn --preload, fetch the key set in the master so the workers inherit
+    it, and open the connections in each worker after the fork (see gunicorn.conf.py).
+    """
+    if connections:
+        with app.app_context():
+            for engine in db.engines.values():
+                size = engine.pool.size() if hasattr(engine.pool, 'size') else 1
+                opened = []
+                try:
+                    for _ in range(size):
+                        opened.append(engine.connect())
+                except Exception:
+                    app.logger.warning('Unable to open database connections during warm-up.', exc_info=True)
+                finally:
+                    # Closing returns the connections to the pool, open.
+                    for connection in opened:
+                        connection.close()
+    if jwks:
+        try:
+            jwks_store.refresh()
+        except Exception:
+            app.logger.warning('Unable to fetch JWKS during warm-up.', exc_info=True)
+
+
+def __getattr__(name):
+    # The module level app (E.g.: gunicorn app:app, FLASK_APP=app) is created on
+    # first access rather than at import, so importing this module is cheap.
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 if __name__ == '__main__':
+    app = create_app()
+    warm_up(app)
     #app.run(host='0.0.0.0', port=8080, debug=True)
     app.run()
@@ -1,14 +1,38 @@
+from collections import OrderedDict
 from functools import wraps
+import hashlib
 import json
+import logging
 import os
+import threading
+import time
 from urllib.request import urlopen
 
-from flask import request, abort
-from jose import jwt
+from flask import g, request, abort
+from jose import jwk, jwt
 
-AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
 ALGORITHMS = ['RS256']
-API_AUDIENCE = os.environ['API_AUDIENCE']
+# Seconds a fetched key set is trusted before it is refreshed.
+JWKS_CACHE_TTL = int(os.environ.get('JWKS_CACHE_TTL', 600))
+# Minimum seconds between two fetches, whatever triggered them.
+JWKS_MIN_REFRESH_INTERVAL = int(os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+JWKS_FETCH_TIMEOUT = 5
+# Maximum number of verified token payloads kept in memory.
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+
+logger = logging.getLogger(__name__)
+
+
+# AUTH0_DOMAIN and API_AUDIENCE are read from the environment when first used,
+# not at import, so importing this module needs no configuration.
+def __getattr__(name):
+    if name in ('AUTH0_DOMAIN', 'API_AUDIENCE'):
+        return os.environ[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def jwks_url():
+    return f'https://{os.environ["AUTH0_DOMAIN"]}/.well-known/jwks.json'
 
 
 class AuthError(Exception):
@@ -24,6 +48,156 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+class JWKSStore:
+
+    """JWKSStore
+
+    In-process cache of the Auth0 JSON Web Key Set.
+
+    Keys are indexed by key id and parsed into public key objects once per
+    fetch, so verifying a token doesn't rebuild the key. The key set is
+    fetched lazily, from `url` or the AUTH0_DOMAIN key set if not given, and
+    kept for `ttl` seconds. A token signed
+    with an unknown key id triggers an early refresh, but never more often than
+    once every `min_refresh_interval` seconds. Only one thread fetches at a
+    time; threads that were waiting reuse its result. If a refresh fails, the
+    last good key set keeps being served.
+
+    """
+
+    def __init__(self, url=None, ttl=JWKS_CACHE_TTL, min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                 timeout=JWKS_FETCH_TIMEOUT):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys = {}
+        self._fetched_at = None
+        self._attempted_at = None
+        self._lock = threading.Lock()
+
+    def get_key(self, kid):
+        """Returns the public key for `kid`, or None if the key set doesn't have it."""
+        now = time.monotonic()
+        if self._is_stale(now) and self._may_refresh(now):
+            self.refresh()
+        key = self._keys.get(kid)
+        if key is None and self._may_refresh(now):
+            self.refresh()
+            key = self._keys.get(kid)
+        return key
+
+    def refresh(self):
+        """Fetches the key set, unless another thread did while we waited."""
+        requested_at = time.monotonic()
+        with self._lock:
+            if self._attempted_at is not None and self._attempted_at >= requested_at:
+                return
+            self._attempted_at = time.monotonic()
+            url = self.url or jwks_url()
+            try:
+                jsonurl = urlopen(url, timeout=self.timeout)
+                jwks = json.loads(jsonurl.read())
+                keys = self._build_keys(jwks['keys'])
+            except Exception:
+                if not self._keys:
+                    raise
+                logger.warning('Unable to refresh JWKS from %s, keeping last good key set.',
+                               url, exc_info=True)
+                return
+            self._keys = keys
+            self._fetched_at = self._attempted_at
+
+    @staticmethod
+    def _build_keys(jwks_keys):
+        keys = {}
+        for key in jwks_keys:
+            if 'kid' not in key or key.get('kty') != 'RSA':
+                continue
+            try:
+                keys[key['kid']] = jwk.construct(key, algorithm=key.get('alg', ALGORITHMS[0]))
+            except Exception:
+                logger.warning('Skipping unusable JWK %s.', key['kid'], exc_info=True)
+        return keys
+
+    def has_key(self, kid):
+        """Returns whether `kid` is in the current key set, without refreshing."""
+        return kid in self._keys
+
+    def _is_stale(self, now):
+        return self._fetched_at is None or now - self._fetched_at >= self.ttl
+
+    def _may_refresh(self, now):
+        return self._attempted_at is None or now - self._attempted_at >= self.min_refresh_interval
+
+
+class TokenCache:
+
+    """TokenCache
+
+    Bounded LRU of already verified token payloads.
+
+    Entries are keyed by a SHA-256 digest of the raw token, so tokens aren't
+    kept in memory. An entry is served until the token's `exp` claim, or until
+    the key that signed it disappears from the key set.
+
+    """
+
+    def __init__(self, key_store, maxsize=TOKEN_CACHE_SIZE):
+        self.key_store = key_store
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """Returns the cached payload for `token`, or None."""
+        digest = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                payload, kid = entry
+                if payload['exp'] > time.time() and self.key_store.has_key(kid):
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                    return payload
+                del self._entries[digest]
+            self.misses += 1
+        return None
+
+    def put(self, token, payload, kid):
+        """Caches a verified payload. Tokens without an `exp` claim are not cached."""
+        if not isinstance(payload.get('exp'), (int, float)) or self.maxsize <= 0:
+            return
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest] = (payload, kid)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the hit and miss counters and the current size."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries)
+        }
+
+    @staticmethod
+    def _digest(token):
+        return hashlib.sha256(token.encode()).digest()
+
+
+jwks_store = JWKSStore()
+token_cache = TokenCache(jwks_store)
+
+
 # get_token_auth_header() method
 #     Attempts to get the header from the request,
 #         and raise an AuthError if no header is present.
@@ -56,12 +230,12 @@ def get_token_auth_header():
 
 # check_permissions(permission, payload) method
 #     @INPUTS
-#         permission: string permission (i.e. 'post:movies')
+#         permission: string permission (i.e. 'post:movies'), or a list of permissions that are all required
 #         payload: decoded jwt payload
 #
 #     Raises an AuthError if permissions are not included in the payload.
 #         NOTE: check your RBAC settings in Auth0
-#     Raises an AuthError if the requested permission string is not in the payload permissions array.
+#     Raises an AuthError if a requested permission string is not in the payload permissions array.
 #     Return true otherwise
 def check_permissions(permission, payload):
     if 'permissions' not in payload:
@@ -70,7 +244,8 @@ def check_permissions(permission, payload):
             'description': 'Permissions not included in JWT.'
         }, 400)
 
-    if permission not in payload['permissions']:
+    required = [permission] if isinstance(permission, str) else permission
+    if any(x not in payload['permissions'] for x in required):
         raise AuthError({
             'code': 'forbidden',
             'description': 'Permission not found.'
@@ -84,41 +259,34 @@ def check_permissions(permission, payload):
 #         token: a json web token (string)
 #
 #     it should be an Auth0 token with key id (kid)
-#     it should verify the token using Auth0 /.well-known/jwks.json
+#     it should verify the token using Auth0 /.well-known/jwks.json (cached by jwks_store)
 #     it should decode the payload from the token
 #     it should validate the claims
 #     return the decoded payload
 #
+#     Tokens that were already verified are served from token_cache until they expire.
+#
 #   !!NOTE urlopen has a common certificate error described here:
 #   https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
 def verify_decode_jwt(token):
-    # Get the public key from Auth0
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
 
     # Get the data in the header
     unverified_header = jwt.get_unverified_header(token)
 
     # Choose your key
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = jwks_store.get_key(unverified_header['kid'])
 
     # Verify
-    if not rsa_key:
+    if rsa_key is None:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Unable to find the appropriate key.'
@@ -129,9 +297,10 @@ def verify_decode_jwt(token):
             token,
             rsa_key,
             algorithms=ALGORITHMS,
-            audience=API_AUDIENCE,
-            issuer=f'https://{AUTH0_DOMAIN}/'
+            audience=os.environ['API_AUDIENCE'],
+            issuer=f'https://{os.environ["AUTH0_DOMAIN"]}/'
         )
+        token_cache.put(token, payload, unverified_header['kid'])
         return payload
     except jwt.ExpiredSignatureError:
         raise AuthError({
@@ -152,7 +321,7 @@ def verify_decode_jwt(token):
 
 # @requires_auth(permission) decorator method
 #     @INPUTS
-#         permission: string permission (i.e. 'post:drink')
+#         permission: string permission (i.e. 'post:drink'), or a list of permissions that are all required
 #
 #     it should use the get_token_auth_header method to get the token
 #     it should use the verify_decode_jwt method to decode the jwt
@@ -162,6 +331,7 @@ def requires_auth(permissions=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
+            start = time.perf_counter()
             try:
                 token = get_token_auth_header()
                 payload = verify_decode_jwt(token)
@@ -170,6 +340,9 @@ def requires_auth(permissions=''):
                 abort(e.status_code, e.error.get('description', 'Unknown error'))
             except Exception:
                 abort(422, 'Error processing authentication.')
+            finally:
+                # Recorded per route by metrics.init_app.
+                g.auth_seconds = time.perf_counter() - start
             return f(payload, *args, **kwargs)
 
         return wrapper
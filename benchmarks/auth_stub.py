@@ -0,0 +1,108 @@
+"""Local stand-in for Auth0: a signing key, its key set and token minting.
+
+install() points auth.jwks_store at a data: URL holding the public key set, so
+requires_auth verifies the minted tokens for real (signature, audience, issuer
+and permissions) without any network call. The private key is kept in
+benchmarks/.bench_key.pem, so a server (benchmarks/serve.py) and a load
+client (bench_load.py) running in separate processes agree on it.
+
+    python benchmarks/auth_stub.py [--permissions get:movies,get:actors]
+
+prints a token, E.g.: for manual requests against benchmarks/serve.py.
+
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+import rsa
+from jose import jwk, jwt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from auth.auth import ALGORITHMS, jwks_store  # noqa: E402
+
+KEY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.bench_key.pem')
+KEY_ID = 'bench'
+
+# Every permission of the Executive Producer role.
+PERMISSIONS = (
+    'get:movies', 'get:actors',
+    'post:movies', 'post:actors', 'post:castings',
+    'patch:movies', 'patch:actors',
+    'delete:movies', 'delete:actors', 'delete:castings'
+)
+
+
+def configure_environment():
+    """Provides AUTH0_DOMAIN and API_AUDIENCE when they aren't set, since tokens are checked against them.
+
+    Also METRICS_TOKEN, without which GET /metrics is disabled.
+    """
+    os.environ.setdefault('AUTH0_DOMAIN', 'bench.invalid')
+    os.environ.setdefault('API_AUDIENCE', 'casting')
+    os.environ.setdefault('METRICS_TOKEN', 'bench')
+
+
+def load_private_key():
+    """Returns the PEM private key, generated on first use."""
+    if not os.path.exists(KEY_PATH):
+        _, private_key = rsa.newkeys(2048)
+        with open(KEY_PATH, 'wb') as file:
+            file.write(private_key.save_pkcs1())
+    with open(KEY_PATH) as file:
+        return file.read()
+
+
+def jwks():
+    """Returns the key set (JWKS) of the public key."""
+    private_key = rsa.PrivateKey.load_pkcs1(load_private_key().encode())
+    public_key = rsa.PublicKey(private_key.n, private_key.e).save_pkcs1().decode()
+    key = jwk.construct(public_key, ALGORITHMS[0]).to_dict()
+    key = {k: v.decode() if isinstance(v, bytes) else v for k, v in key.items()}
+    key.update({'kid': KEY_ID, 'use': 'sig'})
+    return {'keys': [key]}
+
+
+def jwks_data_url():
+    """Returns a data: URL holding the key set, which urlopen reads like the Auth0 one."""
+    encoded = base64.b64encode(json.dumps(jwks()).encode()).decode()
+    return f'data:application/json;base64,{encoded}'
+
+
+def install():
+    """Makes requires_auth trust the tokens minted by mint_token()."""
+    configure_environment()
+    jwks_store.url = jwks_data_url()
+    jwks_store.refresh()
+
+
+def mint_token(permissions=PERMISSIONS, ttl=3600, subject='bench'):
+    """Returns a signed access token shaped like Auth0's, with `permissions`."""
+    configure_environment()
+    now = int(time.time())
+    claims = {
+        'iss': f'https://{os.environ["AUTH0_DOMAIN"]}/',
+        'aud': os.environ['API_AUDIENCE'],
+        'sub': subject,
+        'iat': now,
+        'exp': now + ttl,
+        'permissions': list(permissions)
+    }
+    return jwt.encode(claims, load_private_key(), algorithm=ALGORITHMS[0], headers={'kid': KEY_ID})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--permissions', default=','.join(PERMISSIONS))
+    parser.add_argument('--ttl', type=int, default=3600, help='Seconds the token is valid.')
+    args = parser.parse_args()
+    print(mint_token(args.permissions.split(','), args.ttl))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Generates a synthetic catalog, from 1k up to 10M castings, for the benchmarks.
+
+Writes movie.csv, actor.csv and casting.csv in the format of `flask catalog
+export`, so the catalog is loaded with `flask catalog import` (COPY on
+Postgres, in parallel with --workers). The same --castings and --seed always
+give the same files. Movies get --cast-size actors on average and ids start
+at 1, so the load workloads can pick ids from the /stats totals. Actor
+popularity is skewed (a few actors are in many movies), like a real catalog.
+
+    source setup.sh
+    python benchmarks/bench_data.py /tmp/catalog --castings 1000000
+    FLASK_APP=app flask catalog import /tmp/catalog --truncate --workers 4
+
+"""
+import argparse
+import csv
+from datetime import date, timedelta
+import os
+import random
+import time
+
+GENDERS = ('F', 'M')
+WORDS = (
+    'Silent', 'Red', 'Last', 'Lost', 'Midnight', 'Golden', 'Broken', 'Hidden', 'Wild', 'Distant',
+    'River', 'City', 'Garden', 'Storm', 'Harbor', 'Mirror', 'Empire', 'Summer', 'Shadow', 'Signal'
+)
+FIRST_NAMES = (
+    'Ada', 'Ben', 'Cleo', 'Dev', 'Eva', 'Finn', 'Gia', 'Hugo', 'Ines', 'Jon',
+    'Kai', 'Lena', 'Milo', 'Nora', 'Omar', 'Pia', 'Quin', 'Rosa', 'Sam', 'Tess'
+)
+LAST_NAMES = (
+    'Adams', 'Baker', 'Chen', 'Diaz', 'Evans', 'Fox', 'Garcia', 'Hill', 'Ito', 'Jones',
+    'Khan', 'Lopez', 'Moore', 'Novak', 'Okafor', 'Park', 'Reyes', 'Silva', 'Tanaka', 'Wood'
+)
+
+
+def catalog_size(castings, cast_size):
+    """Returns the number of movies and actors for `castings`."""
+    movies = max(1, -(-castings // cast_size))
+    actors = max(cast_size, movies // 2)
+    return movies, actors
+
+
+def write_movies(path, count, rng):
+    start = date(1950, 1, 1)
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(('id', 'title', 'release_date'))
+        for movie_id in range(1, count + 1):
+            title = f'{rng.choice(WORDS)} {rng.choice(WORDS)} {movie_id}'
+            writer.writerow((movie_id, title, (start + timedelta(days=rng.randrange(27000))).isoformat()))
+
+
+def write_actors(path, count, rng):
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(('id', 'name', 'age', 'gender'))
+        for actor_id in range(1, count + 1):
+            name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {actor_id}'
+            writer.writerow((actor_id, name, rng.randint(5, 90), rng.choice(GENDERS)))
+
+
+def write_castings(path, castings, movies, actors, cast_size, rng):
+    """Writes `castings` distinct (movie, actor) pairs, `cast_size` per movie except the last one."""
+    casting_id = 0
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(('id', 'movie_id', 'actor_id'))
+        for movie_id in range(1, movies + 1):
+            cast = set()
+            size = min(cast_size, castings - casting_id)
+            while len(cast) < size:
+                # Skewed towards low actor ids: the square of a uniform number.
+                cast.add(int(rng.random() ** 2 * actors) + 1)
+            for actor_id in sorted(cast):
+                casting_id += 1
+                writer.writerow((casting_id, movie_id, actor_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--castings', type=int, default=1000, help='Between 1000 and 10000000.')
+    parser.add_argument('--cast-size', type=int, default=10, help='Actors per movie.')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    if not 1000 <= args.castings <= 10000000:
+        parser.error('--castings must be between 1000 and 10000000')
+
+    os.makedirs(args.directory, exist_ok=True)
+    movies, actors = catalog_size(args.castings, args.cast_size)
+    started = time.perf_counter()
+    rng = random.Random(args.seed)
+    write_movies(os.path.join(args.directory, 'movie.csv'), movies, rng)
+    write_actors(os.path.join(args.directory, 'actor.csv'), actors, rng)
+    write_castings(os.path.join(args.directory, 'casting.csv'), args.castings, movies, actors, args.cast_size, rng)
+    print(f'{movies} movies, {actors} actors, {args.castings} castings '
+          f'written to {args.directory} in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Compares Flask's default JSON provider with FastJSONProvider.
+
+Serializes a response shaped like GET /movies with 10k movies through each
+provider's response(), which is what jsonify() calls.
+
+    python benchmarks/bench_json.py [--rows 10000] [--repeat 20]
+
+"""
+import argparse
+from datetime import date, timedelta
+import os
+import sys
+import timeit
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json_provider  # noqa: E402
+
+
+def make_payload(rows):
+    start = date(1950, 1, 1)
+    return {
+        'success': True,
+        'movies': [
+            {'id': i, 'title': f'Movie {i}', 'release_date': start + timedelta(days=i)}
+            for i in range(1, rows + 1)
+        ],
+        'total_movies': rows
+    }
+
+
+def bench(name, provider, payload, repeat):
+    with provider._app.app_context():
+        size = len(provider.response(payload).get_data())
+        best = min(timeit.repeat(lambda: provider.response(payload), number=1, repeat=repeat))
+    print(f'{name:<26} {best * 1000:8.2f} ms {size / 1024:8.1f} KiB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    payload = make_payload(args.rows)
+    print(f'{args.rows} rows, best of {args.repeat}')
+    bench('DefaultJSONProvider', DefaultJSONProvider(app), payload, args.repeat)
+    if json_provider.orjson is not None:
+        bench('FastJSONProvider (orjson)', json_provider.FastJSONProvider(app), payload, args.repeat)
+    orjson, json_provider.orjson = json_provider.orjson, None
+    bench('FastJSONProvider (json)', json_provider.FastJSONProvider(app), payload, args.repeat)
+    json_provider.orjson = orjson
+
+
+if __name__ == '__main__':
+    main()
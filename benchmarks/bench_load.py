@@ -0,0 +1,411 @@
+"""Load benchmark: scripted workloads over every route, with latency percentiles and throughput.
+
+Requests carry tokens minted by auth_stub.py, so nothing reaches Auth0. By
+default the app runs in this process and requests go through Flask's test
+client, which measures the app and the database without HTTP (threads share
+one interpreter, so raise --concurrency with care). With --url, requests go to
+a running server over keep-alive HTTP connections, E.g.:
+
+    gunicorn -c gunicorn.conf.py benchmarks.serve:app
+
+Load a catalog first (see bench_data.py); ids are picked from the /stats totals.
+The write operations delete what they create, so the catalog stays the same.
+
+    source setup.sh
+    python benchmarks/bench_load.py [--workload read|write|mixed|all] [--concurrency 4] [--duration 30]
+                                    [--warm-up 5] [--url http://localhost:8000] [--output FILE]
+
+Results are saved to benchmarks/results/ (named by time, commit and workload);
+compare two runs with benchmarks/compare.py.
+
+"""
+import argparse
+from datetime import datetime, timezone
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, ROOT)
+
+import auth_stub  # noqa: E402
+
+RESULTS_DIRECTORY = os.path.join(BENCHMARKS, 'results')
+WORDS = ('Silent', 'Red', 'Last', 'Lost', 'Midnight', 'Golden', 'River', 'City', 'Storm', 'Shadow')
+
+
+#################################################################################
+# Transports
+#################################################################################
+
+class InProcessTransport:
+
+    """InProcessTransport
+
+    Sends requests to an app created in this process, through a test client per thread.
+
+    """
+
+    def __init__(self):
+        auth_stub.install()
+        import app as app_module
+        self.app = app_module.create_app()
+        app_module.warm_up(self.app, jwks=False)
+        self.target = 'in-process'
+        self._local = threading.local()
+
+    def request(self, method, path, body, headers):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_data()
+
+
+class HTTPTransport:
+
+    """HTTPTransport
+
+    Sends requests to a running server, over one keep-alive connection per thread.
+
+    """
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.target = url
+        self._local = threading.local()
+
+    def request(self, method, path, body, headers):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self.connection_class(self.netloc, timeout=30)
+        headers = dict(headers)
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        try:
+            connection.request(method, self.prefix + path, body=data, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self._local.connection = None
+            raise
+
+
+#################################################################################
+# Operations
+#################################################################################
+
+class Session:
+
+    """Session
+
+    Times the requests of one worker thread, by operation label (method and route template).
+
+    """
+
+    def __init__(self, transport, token, catalog, rng):
+        self.transport = transport
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.catalog = catalog
+        self.rng = rng
+        self.recording = False
+        self.samples = {}
+        self.statuses = {}
+
+    def call(self, label, method, path, body=None, headers=None):
+        """Sends one request and returns its status and decoded JSON body (or None)."""
+        start = time.perf_counter()
+        try:
+            status, data = self.transport.request(method, path, body, headers or self.headers)
+        except Exception:
+            status, data = 0, b''
+        elapsed = time.perf_counter() - start
+        if self.recording:
+            self.samples.setdefault(label, []).append(elapsed)
+            statuses = self.statuses.setdefault(label, {})
+            statuses[status] = statuses.get(status, 0) + 1
+        try:
+            return status, json.loads(data)
+        except ValueError:
+            return status, None
+
+    def movie_id(self):
+        return self.rng.randint(1, self.catalog['total_movies'])
+
+    def actor_id(self):
+        return self.rng.randint(1, self.catalog['total_actors'])
+
+    def page(self, total):
+        return self.rng.randint(1, max(1, min(50, math.ceil(total / 10))))
+
+
+def list_movies(s):
+    s.call('GET /movies', 'GET', f'/movies?page={s.page(s.catalog["total_movies"])}')
+
+
+def list_movies_filtered(s):
+    s.call('GET /movies?title&sort', 'GET', f'/movies?title={s.rng.choice(WORDS)}&sort=-release_date')
+
+
+def list_movies_included(s):
+    s.call('GET /movies?include', 'GET', f'/movies?include=actors&page={s.page(s.catalog["total_movies"])}')
+
+
+def list_actors(s):
+    s.call('GET /actors', 'GET', f'/actors?page={s.page(s.catalog["total_actors"])}')
+
+
+def list_actors_filtered(s):
+    s.call('GET /actors?gender&min_age', 'GET', f'/actors?gender={s.rng.choice("FM")}&min_age=30&sort=name')
+
+
+def get_movie(s):
+    s.call('GET /movies/<id>', 'GET', f'/movies/{s.movie_id()}')
+
+
+def get_movie_included(s):
+    s.call('GET /movies/<id>?include', 'GET', f'/movies/{s.movie_id()}?include=actors')
+
+
+def get_actor(s):
+    s.call('GET /actors/<id>', 'GET', f'/actors/{s.actor_id()}')
+
+
+def get_movie_actors(s):
+    s.call('GET /movies/<id>/actors', 'GET', f'/movies/{s.movie_id()}/actors')
+
+
+def get_actor_movies(s):
+    s.call('GET /actors/<id>/movies', 'GET', f'/actors/{s.actor_id()}/movies')
+
+
+def search(s):
+    s.call('GET /search', 'GET', f'/search?q={s.rng.choice(WORDS).lower()}')
+
+
+def stats(s):
+    s.call('GET /stats', 'GET', '/stats')
+
+
+def export(s):
+    table = s.rng.choice(('movies', 'actors', 'castings'))
+    s.call(f'GET /export/{table}', 'GET', f'/export/{table}')
+
+
+def get_metrics(s):
+    s.call('GET /metrics', 'GET', '/metrics', headers={'Authorization': f'Bearer {os.environ["METRICS_TOKEN"]}'})
+
+
+def movie_lifecycle(s):
+    status, body = s.call('POST /movies', 'POST', '/movies', {'title': 'Bench Movie', 'release_date': '2024-01-01'})
+    if status == 201:
+        s.call('PATCH /movies/<id>', 'PATCH', f'/movies/{body["created_id"]}', {'title': 'Bench Movie 2'})
+        s.call('DELETE /movies/<id>', 'DELETE', f'/movies/{body["created_id"]}')
+
+
+def actor_lifecycle(s):
+    status, body = s.call('POST /actors', 'POST', '/actors', {'name': 'Bench Actor', 'age': 40, 'gender': 'F'})
+    if status == 201:
+        s.call('PATCH /actors/<id>', 'PATCH', f'/actors/{body["created_id"]}', {'age': 41})
+        s.call('DELETE /actors/<id>', 'DELETE', f'/actors/{body["created_id"]}')
+
+
+def casting_lifecycle(s):
+    status, body = s.call('POST /castings', 'POST', '/castings', {'movie_id': s.movie_id(), 'actor_id': s.actor_id()})
+    # An existing pairing (200) belongs to the catalog: only delete what was created.
+    if status == 201:
+        s.call('DELETE /castings/<id>', 'DELETE', f'/castings/{body["created_id"]}')
+
+
+def bulk_lifecycle(s):
+    actors = [{'name': f'Bench Actor {i}', 'age': 30 + i, 'gender': 'M'} for i in range(10)]
+    status, body = s.call('POST /actors/bulk', 'POST', '/actors/bulk', actors)
+    actor_ids = [x for x in (body or {}).get('created_ids', []) if x]
+    movies = [{'title': f'Bench Movie {i}', 'release_date': '2024-01-01'} for i in range(10)]
+    status, body = s.call('POST /movies/bulk', 'POST', '/movies/bulk', movies)
+    movie_ids = [x for x in (body or {}).get('created_ids', []) if x]
+    if actor_ids and movie_ids:
+        castings = [{'movie_id': movie_id, 'actor_id': actor_id} for movie_id in movie_ids for actor_id in actor_ids]
+        s.call('POST /castings/bulk', 'POST', '/castings/bulk', castings)
+    # Deleting the movies and actors cascades to their castings.
+    for movie_id in movie_ids:
+        s.call('DELETE /movies/<id>', 'DELETE', f'/movies/{movie_id}')
+    for actor_id in actor_ids:
+        s.call('DELETE /actors/<id>', 'DELETE', f'/actors/{actor_id}')
+
+
+READ_OPERATIONS = {
+    list_movies: 10, list_movies_filtered: 4, list_movies_included: 2,
+    list_actors: 10, list_actors_filtered: 4,
+    get_movie: 20, get_movie_included: 4, get_actor: 20,
+    get_movie_actors: 8, get_actor_movies: 8,
+    search: 6, stats: 2
+}
+WRITE_OPERATIONS = {movie_lifecycle: 4, actor_lifecycle: 4, casting_lifecycle: 4, bulk_lifecycle: 1}
+
+WORKLOADS = {
+    'read': READ_OPERATIONS,
+    'write': WRITE_OPERATIONS,
+    'mixed': {**READ_OPERATIONS, **{k: v * 2 for k, v in WRITE_OPERATIONS.items()}},
+    # Every route of create_app, the heavy exports included.
+    'all': {**READ_OPERATIONS, **WRITE_OPERATIONS, export: 1, get_metrics: 1}
+}
+
+
+#################################################################################
+# Runner
+#################################################################################
+
+def percentile(values, p):
+    """Returns the nearest-rank `p` percentile of sorted `values`."""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(samples, statuses, duration):
+    values = sorted(samples)
+    errors = sum(count for status, count in statuses.items() if not 200 <= status < 400)
+    return {
+        'count': len(values),
+        'errors': errors,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'rps': len(values) / duration,
+        'mean_ms': sum(values) / len(values) * 1000,
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': values[-1] * 1000
+    }
+
+
+def run(transport, workload, concurrency, duration, warm_up, seed):
+    token = auth_stub.mint_token(ttl=int(warm_up + duration) + 600)
+    status, body = Session(transport, token, None, None).call('GET /stats', 'GET', '/stats?limit=1')
+    if status != 200:
+        raise SystemExit(f'GET /stats failed with {status}: {body}')
+    catalog = {k: body[k] for k in ('total_movies', 'total_actors', 'total_castings')}
+    if not catalog['total_movies'] or not catalog['total_actors']:
+        raise SystemExit('The catalog is empty, load one first (see bench_data.py).')
+
+    operations = WORKLOADS[workload]
+    sessions = [Session(transport, token, catalog, random.Random(seed + i)) for i in range(concurrency)]
+    recording_started = threading.Event()
+    stop = threading.Event()
+
+    def work(session):
+        functions, weights = list(operations), list(operations.values())
+        while not stop.is_set():
+            session.recording = recording_started.is_set()
+            session.rng.choices(functions, weights)[0](session)
+
+    threads = [threading.Thread(target=work, args=(x,)) for x in sessions]
+    for thread in threads:
+        thread.start()
+    time.sleep(warm_up)
+    recording_started.set()
+    started = time.perf_counter()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    samples = {}
+    for session in sessions:
+        for label, values in session.samples.items():
+            samples.setdefault(label, []).extend(values)
+    statuses = {label: merge_counts(x.statuses.get(label, {}) for x in sessions) for label in samples}
+
+    routes = {label: summarize(samples[label], statuses[label], elapsed) for label in sorted(samples)}
+    total = summarize([x for values in samples.values() for x in values], merge_counts(statuses.values()), elapsed)
+    return catalog, elapsed, routes, total
+
+
+def merge_counts(counters):
+    merged = {}
+    for counter in counters:
+        for k, v in counter.items():
+            merged[k] = merged.get(k, 0) + v
+    return merged
+
+
+def git_commit():
+    """Returns the current commit, with a -dirty suffix if tracked files changed, or None outside git."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                                capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, check=True,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def print_report(result):
+    meta = result['meta']
+    print(f'{meta["workload"]} workload, {meta["concurrency"]} threads, {meta["duration"]:.1f}s '
+          f'against {meta["target"]} ({meta["catalog"]["total_castings"]} castings)')
+    print(f'{"operation":<28} {"count":>7} {"err":>5} {"req/s":>8} {"p50":>9} {"p95":>9} {"p99":>9}')
+    for label, row in list(result['routes'].items()) + [('TOTAL', result['total'])]:
+        print(f'{label:<28} {row["count"]:>7} {row["errors"]:>5} {row["rps"]:>8.1f} '
+              f'{row["p50_ms"]:>7.2f}ms {row["p95_ms"]:>7.2f}ms {row["p99_ms"]:>7.2f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workload', choices=sorted(WORKLOADS), default='mixed')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=30, help='Seconds measured.')
+    parser.add_argument('--warm-up', type=float, default=5, help='Seconds run before measuring.')
+    parser.add_argument('--url', help='Base URL of a running server. Default: the app, in this process.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Result file. Default: benchmarks/results/<time>-<commit>-<workload>.json')
+    args = parser.parse_args()
+
+    transport = HTTPTransport(args.url) if args.url else InProcessTransport()
+    catalog, elapsed, routes, total = run(transport, args.workload, args.concurrency, args.duration,
+                                          args.warm_up, args.seed)
+    now = datetime.now(timezone.utc)
+    commit = git_commit()
+    result = {
+        'meta': {
+            'time': now.isoformat(timespec='seconds'),
+            'commit': commit,
+            'workload': args.workload,
+            'concurrency': args.concurrency,
+            'duration': elapsed,
+            'target': transport.target,
+            'database': (os.environ.get('DATABASE_URL') or '').split(':', 1)[0] or None,
+            'catalog': catalog,
+            'python': platform.python_version()
+        },
+        'routes': routes,
+        'total': total
+    }
+    print_report(result)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        output = os.path.join(RESULTS_DIRECTORY, f'{now:%Y%m%dT%H%M%S}-{commit or "nogit"}-{args.workload}.json')
+    with open(output, 'w') as file:
+        json.dump(result, file, indent=2)
+    print(f'Saved to {output}')
+
+
+if __name__ == '__main__':
+    main()
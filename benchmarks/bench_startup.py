@@ -0,0 +1,86 @@
+"""Measures app startup: import, create_app(), warm-up and first request latency.
+
+Each run starts a fresh interpreter, so nothing is cached between runs. The
+requests are authenticated GET /movies, which verify a token and query the
+database. Tokens are signed by benchmarks/auth_stub.py and its key set is
+read from a data: URL, so nothing reaches Auth0 (the key set fetch that
+warm-up saves is therefore cheaper here than against Auth0). --warm-up adds
+the time taken by warm_up() (database connections and the key set fetch)
+and shows what it saves on the first request.
+
+    source setup.sh
+    python benchmarks/bench_startup.py [--runs 10] [--warm-up]
+
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import auth_stub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json
+import time
+
+start = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+app_module.jwks_store.url = {jwks_url!r}
+app = app_module.create_app()
+created = time.perf_counter()
+if {warm_up}:
+    app_module.warm_up(app)
+warmed = time.perf_counter()
+client = app.test_client()
+status = client.get('/movies', headers={headers!r}).status_code
+first = time.perf_counter()
+client.get('/movies', headers={headers!r})
+second = time.perf_counter()
+
+print(json.dumps({{
+    'status': status,
+    'import': imported - start,
+    'create_app': created - imported,
+    'warm_up': warmed - created,
+    'first_request': first - warmed,
+    'second_request': second - first,
+}}))
+'''
+
+
+def run_once(warm_up, jwks_url, headers):
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD.format(warm_up=warm_up, jwks_url=jwks_url, headers=headers)],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    result = json.loads(output.splitlines()[-1])
+    if result.pop('status') != 200:
+        raise SystemExit('The first request failed, check DATABASE_URL and the migrations.')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--warm-up', action='store_true', help='Call warm_up() before the first request.')
+    args = parser.parse_args()
+
+    # Set in this process before the children inherit the environment.
+    auth_stub.configure_environment()
+    jwks_url = auth_stub.jwks_data_url()
+    headers = {'Authorization': f'Bearer {auth_stub.mint_token(ttl=3600)}'}
+    results = [run_once(args.warm_up, jwks_url, headers) for _ in range(args.runs)]
+    print(f'{args.runs} runs, warm-up {"on" if args.warm_up else "off"}')
+    print(f'{"step":<16} {"median":>10} {"max":>10}')
+    for step in results[0]:
+        values = [x[step] * 1000 for x in results]
+        print(f'{step:<16} {statistics.median(values):8.2f}ms {max(values):8.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
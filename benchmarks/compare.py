@@ -0,0 +1,63 @@
+"""Compares two bench_load.py results, operation by operation.
+
+Prints the p50, p95 and p99 latency and the throughput of both runs and their
+change. Exits with status 1 when an operation regressed by more than
+--threshold percent (p95 latency up, or throughput down), so it can gate CI.
+
+    python benchmarks/compare.py benchmarks/results/OLD.json benchmarks/results/NEW.json [--threshold 10]
+
+"""
+import argparse
+import json
+import sys
+
+METRICS = (('p50_ms', 'p50'), ('p95_ms', 'p95'), ('p99_ms', 'p99'), ('rps', 'req/s'))
+
+
+def change(old, new):
+    return (new - old) / old * 100 if old else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10, help='Percent change counted as a regression.')
+    args = parser.parse_args()
+
+    with open(args.old) as file:
+        old = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+
+    for label, result in (('old', old), ('new', new)):
+        meta = result['meta']
+        print(f'{label}: {meta["commit"]} {meta["workload"]} x{meta["concurrency"]} against {meta["target"]} '
+              f'({meta["catalog"]["total_castings"]} castings) at {meta["time"]}')
+    if (old['meta']['workload'], old['meta']['catalog']) != (new['meta']['workload'], new['meta']['catalog']):
+        print('WARNING: the workloads or catalogs differ.')
+
+    header = ''.join(f' {name:^26}' for _, name in METRICS)
+    print(f'{"operation":<28}{header}')
+    regressions = []
+    rows = [(x, old['routes'].get(x), new['routes'].get(x)) for x in sorted(set(old['routes']) | set(new['routes']))]
+    for label, before, after in rows + [('TOTAL', old['total'], new['total'])]:
+        if before is None or after is None:
+            print(f'{label:<28} only in {"new" if before is None else "old"}')
+            continue
+        cells = ''.join(
+            f' {before[key]:>8.1f} -> {after[key]:<8.1f}{change(before[key], after[key]):>+5.0f}%' for key, _ in METRICS
+        )
+        regressed = (change(before['p95_ms'], after['p95_ms']) > args.threshold
+                     or change(before['rps'], after['rps']) < -args.threshold)
+        if regressed:
+            regressions.append(label)
+        print(f'{label:<28}{cells}{"  REGRESSION" if regressed else ""}')
+
+    if regressions:
+        print(f'{len(regressions)} operations regressed by more than {args.threshold:g}%.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""The app, trusting the tokens of auth_stub.py instead of Auth0's, for bench_load.py --url.
+
+    source setup.sh
+    gunicorn -c gunicorn.conf.py benchmarks.serve:app
+
+"""
+import os
+import sys
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+
+import auth_stub  # noqa: E402
+
+auth_stub.install()
+
+# The module level app, which the hooks of gunicorn.conf.py use too.
+from app import app  # noqa: E402,F401
@@ -0,0 +1,175 @@
+"""Read-through cache of formatted Movie and Actor records.
+
+Records are cached by kind (table name), change version of the table
+(see models.bump_versions) and id. A write bumps the version, so every
+worker stops serving the records cached before it, without having to
+see an invalidation, and a record is never served with an ETag built
+from a newer version than its own. Invalidation is therefore table-wide:
+a write to one movie leaves every cached movie behind, and they are
+reloaded on their next read. A hit costs no query of its own, since the
+version is the one the ETag of the request is built from. The default backend is an in-process
+TTL + LRU map, so each worker process has its own copy. Set
+ENTITY_CACHE_URL to a Redis (or Redis protocol compatible) server to
+share the cache between all workers.
+
+"""
+from collections import OrderedDict
+from datetime import date
+import json
+import os
+import threading
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Seconds a cached record is served before it is reloaded. 0 disables the cache.
+ENTITY_CACHE_TTL = int(os.environ.get('ENTITY_CACHE_TTL', 30))
+# Maximum number of records kept by the in-process backend.
+ENTITY_CACHE_SIZE = int(os.environ.get('ENTITY_CACHE_SIZE', 4096))
+# Eg: redis://localhost:6379/0
+ENTITY_CACHE_URL = os.environ.get('ENTITY_CACHE_URL')
+
+
+class LocalBackend:
+
+    """In-process TTL + LRU map. Thread-safe, but not shared between processes."""
+
+    def __init__(self, ttl=ENTITY_CACHE_TTL, maxsize=ENTITY_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return dict(value)
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (dict(value), time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+
+    """Backend on a Redis protocol server, shared by every worker. Eviction is left to the server."""
+
+    def __init__(self, url, ttl=ENTITY_CACHE_TTL, prefix='casting:entity:'):
+        if redis is None:
+            raise RuntimeError('ENTITY_CACHE_URL is set but the redis package is not installed.')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value, object_hook=_decode_date) if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value, default=_encode_date), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(f'{self.prefix}*'):
+            self.client.delete(key)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(f'{self.prefix}*'))
+
+
+def _encode_date(value):
+    if isinstance(value, date):
+        return {'$date': value.isoformat()}
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _decode_date(value):
+    if len(value) == 1 and '$date' in value:
+        return date.fromisoformat(value['$date'])
+    return value
+
+
+class EntityCache:
+
+    """EntityCache
+
+    Read-through cache of formatted records, keyed by kind, version and id,
+    with hit and miss counters.
+
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, kind, version, record_id, load):
+        """Returns the cached record, or calls `load()` and caches its result unless it is None.
+
+        `version` must be read before `load()` runs, so a record is never cached
+        under a newer version than the one it was loaded at.
+        """
+        if self.backend is None:
+            return load()
+        key = f'{kind}:{version}:{record_id}'
+        record = self.backend.get(key)
+        if record is not None:
+            self.hits += 1
+            return record
+        self.misses += 1
+        record = load()
+        if record is not None:
+            self.backend.set(key, record)
+        return record
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        """Returns the hit and miss counters, the hit rate and the current size."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self.backend) if isinstance(self.backend, LocalBackend) else None
+        }
+
+
+def create_backend(url=ENTITY_CACHE_URL, ttl=ENTITY_CACHE_TTL):
+    """Returns the configured backend, or None if the cache is disabled."""
+    if ttl <= 0:
+        return None
+    if url:
+        return RedisBackend(url, ttl=ttl)
+    return LocalBackend(ttl=ttl)
+
+
+entity_cache = EntityCache(create_backend())
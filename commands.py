@@ -0,0 +1,273 @@
+"""Flask CLI commands to export and import the catalog offline.
+
+    flask catalog export <directory> [--format csv|ndjson]
+    flask catalog import <directory> [--format csv|ndjson] [--workers N] [--batch-size N] [--truncate]
+
+Each table is written to / read from `<directory>/<table>.<format>`. Ids are
+exported and imported as-is, so references between tables stay stable.
+On Postgres, CSV is moved with COPY; elsewhere rows are batched through
+executemany.
+
+"""
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import csv
+from datetime import date
+import io
+import json
+import os
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import create_engine, select, text
+
+from cache import entity_cache
+from models import COUNTER_COLUMNS, bump_versions, db
+
+# Tables in foreign-key order: referenced tables are imported first.
+CATALOG_TABLES = ('movie', 'actor', 'casting')
+IMPORT_BATCH_SIZE = 10000
+
+catalog_cli = AppGroup('catalog', help='Export and import movies, actors and castings.')
+
+
+def table_path(directory, table, file_format):
+    return os.path.join(directory, f'{table.name}.{file_format}')
+
+
+def catalog_columns(table):
+    """Returns the columns that are exported and imported, leaving out the trigger maintained counters."""
+    return [x for x in table.columns if x.name != COUNTER_COLUMNS.get(table.name)]
+
+
+def json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def export_table(connection, table, file, file_format):
+    """Writes every row of `table` to `file` in id order. Returns the number of rows."""
+    columns = catalog_columns(table)
+    if connection.dialect.name == 'postgresql' and file_format == 'csv':
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(f'COPY (SELECT {", ".join(x.name for x in columns)} FROM {table.name} ORDER BY id) '
+                           f'TO STDOUT WITH CSV HEADER', file)
+        return cursor.rowcount
+
+    result = connection.execution_options(stream_results=True).execute(
+        select(*columns).order_by(table.c.id)
+    )
+    writer = None
+    if file_format == 'csv':
+        writer = csv.writer(file)
+        writer.writerow([x.name for x in columns])
+
+    count = 0
+    for rows in result.partitions(IMPORT_BATCH_SIZE):
+        if writer:
+            writer.writerows(rows)
+        else:
+            file.writelines(json.dumps(dict(row._mapping), default=json_default) + '\n' for row in rows)
+        count += len(rows)
+    return count
+
+
+def read_records(path, file_format):
+    """Yields each record of an export file as a dict of column name to raw value."""
+    with open(path, newline='') as file:
+        if file_format == 'csv':
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def typed_row(table, record):
+    """Converts a raw record to column values; empty CSV values are NULL."""
+    row = {}
+    for column in catalog_columns(table):
+        value = record.get(column.name)
+        if value is None or value == '':
+            row[column.name] = None
+        elif column.type.python_type is int:
+            row[column.name] = int(value)
+        elif column.type.python_type is date:
+            row[column.name] = date.fromisoformat(value)
+        else:
+            row[column.name] = value
+    return row
+
+
+def batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_rows(connection, table, rows):
+    """Inserts `rows` into `table` on `connection`, with COPY on Postgres."""
+    columns = catalog_columns(table)
+    if connection.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        # Strings are quoted so '' stays an empty string; unquoted empty fields are NULL.
+        csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(
+            [row[x.name] if not isinstance(row[x.name], date) else row[x.name].isoformat()
+             for x in columns] for row in rows
+        )
+        buffer.seek(0)
+        connection.connection.cursor().copy_expert(
+            f'COPY {table.name} ({", ".join(x.name for x in columns)}) FROM STDIN WITH CSV', buffer
+        )
+    else:
+        connection.execute(table.insert(), rows)
+    return len(rows)
+
+
+_worker_engine = None
+
+
+def init_worker(database_url):
+    global _worker_engine
+    _worker_engine = create_engine(database_url)
+
+
+def load_batch(table_name, rows):
+    """Process pool task: loads one batch in its own connection and transaction."""
+    with _worker_engine.begin() as connection:
+        return load_rows(connection, db.metadata.tables[table_name], rows)
+
+
+def load_parallel(pool, table_name, row_batches, max_in_flight):
+    """Loads `row_batches` through the process `pool`, and returns the number of rows.
+
+    At most `max_in_flight` batches are submitted and not yet loaded at a time, so
+    the file is read no faster than the workers load it and memory stays bounded.
+    """
+    count = 0
+    pending = set()
+    for rows in row_batches:
+        if len(pending) >= max_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            count += sum(x.result() for x in done)
+        pending.add(pool.submit(load_batch, table_name, rows))
+    return count + sum(x.result() for x in pending)
+
+
+def set_counter_trigger(connection, enabled):
+    """Enables or disables the trigger that maintains cast_count and credit_count on casting inserts (Postgres).
+
+    Parallel batches of castings would update overlapping movie and actor rows in
+    no particular order, and deadlock; the counters are recomputed once instead.
+    """
+    connection.execute(text(f'ALTER TABLE casting {"ENABLE" if enabled else "DISABLE"} TRIGGER casting_counts_insert'))
+
+
+def recompute_counters(connection):
+    """Sets cast_count and credit_count from the castings."""
+    for table, column in COUNTER_COLUMNS.items():
+        connection.execute(text(
+            f'UPDATE {table} SET {column} = (SELECT count(*) FROM casting WHERE casting.{table}_id = {table}.id)'
+        ))
+
+
+def reset_sequences(connection):
+    """Moves the id sequences past the imported ids, so new records don't collide with them."""
+    if connection.dialect.name != 'postgresql':
+        return
+    for name in CATALOG_TABLES:
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) "
+            f'FROM {name}'
+        ))
+
+
+def truncate_catalog(connection):
+    """Deletes every movie, actor and casting."""
+    for name in reversed(CATALOG_TABLES):
+        connection.execute(db.metadata.tables[name].delete())
+
+
+def refresh_catalog_versions():
+    """Bumps the catalog table versions and clears the entity cache, so ETags and cached records follow the import."""
+    bump_versions(*CATALOG_TABLES)
+    db.session.commit()
+    entity_cache.clear()
+
+
+@catalog_cli.command('export')
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']), default='csv', show_default=True)
+def export_command(directory, file_format):
+    """Exports the catalog to DIRECTORY."""
+    os.makedirs(directory, exist_ok=True)
+    with db.engine.connect() as connection:
+        for name in CATALOG_TABLES:
+            table = db.metadata.tables[name]
+            path = table_path(directory, table, file_format)
+            with open(path, 'w', newline='') as file:
+                count = export_table(connection, table, file, file_format)
+            click.echo(f'Exported {count} rows to {path}')
+
+
+@catalog_cli.command('import')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']), default='csv', show_default=True)
+@click.option('--workers', default=1, show_default=True,
+              help='Processes loading batches in parallel (Postgres only). Each batch commits on its own.')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True, help='Rows per COPY or executemany.')
+@click.option('--truncate', is_flag=True, help='Delete the existing catalog first.')
+def import_command(directory, file_format, workers, batch_size, truncate):
+    """Imports the catalog from DIRECTORY.
+
+    With a single worker the whole import, --truncate included, runs in one
+    transaction. With --workers the truncate commits on its own before the batches,
+    so a failed parallel import leaves the catalog partly loaded.
+    """
+    engine = db.engine
+    if workers > 1 and engine.dialect.name != 'postgresql':
+        click.echo('Parallel import is only supported on Postgres, using 1 worker.')
+        workers = 1
+
+    if workers > 1:
+        database_url = engine.url.render_as_string(hide_password=False)
+        try:
+            with engine.begin() as connection:
+                if truncate:
+                    truncate_catalog(connection)
+                set_counter_trigger(connection, False)
+            try:
+                with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(database_url,)) as pool:
+                    for name in CATALOG_TABLES:
+                        table = db.metadata.tables[name]
+                        path = table_path(directory, table, file_format)
+                        records = (typed_row(table, x) for x in read_records(path, file_format))
+                        # All batches of a table finish before the tables that reference it start.
+                        count = load_parallel(pool, name, batches(records, batch_size), 2 * workers)
+                        click.echo(f'Imported {count} rows from {path}')
+            finally:
+                # Also after a failure, for the batches that did commit.
+                with engine.begin() as connection:
+                    set_counter_trigger(connection, True)
+                    recompute_counters(connection)
+                    reset_sequences(connection)
+        finally:
+            # The truncate and the batches may have committed even if the import failed.
+            refresh_catalog_versions()
+    else:
+        with engine.begin() as connection:
+            if truncate:
+                truncate_catalog(connection)
+            for name in CATALOG_TABLES:
+                table = db.metadata.tables[name]
+                path = table_path(directory, table, file_format)
+                records = (typed_row(table, x) for x in read_records(path, file_format))
+                count = sum(load_rows(connection, table, rows) for rows in batches(records, batch_size))
+                click.echo(f'Imported {count} rows from {path}')
+            reset_sequences(connection)
+        refresh_catalog_versions()
@@ -0,0 +1,35 @@
+"""gunicorn settings. Used automatically when gunicorn is started from this directory:
+
+    gunicorn app:app
+
+The app is loaded once in the master before the workers are forked, so the
+workers share its memory (copy-on-write) and boot without importing anything.
+
+"""
+import os
+
+bind = f'0.0.0.0:{os.environ.get("PORT", "8000")}'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+preload_app = True
+
+
+def when_ready(server):
+    # Runs in the master once the app is loaded: fetch the key set once for all workers.
+    from app import app, warm_up
+    warm_up(app, connections=False)
+
+
+def post_fork(server, worker):
+    # Connections the master may have opened must not be shared with the workers.
+    # close=False leaves them to the master instead of closing them under it.
+    from app import app
+    from models import db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    # Each worker opens its own pool of connections before taking requests.
+    from app import app, warm_up
+    warm_up(app, jwks=False)
@@ -0,0 +1,63 @@
+"""JSON provider used by the app for jsonify() and request bodies.
+
+Uses orjson when it is installed, and the stdlib json module otherwise.
+Both encode dates as ISO-8601 (E.g.: 1994-10-04), keep key order as
+built and write compact output.
+
+"""
+from datetime import date
+from decimal import Decimal
+import json
+import uuid
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    """Encodes the types the JSON encoders don't handle natively."""
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if isinstance(obj, (Decimal, uuid.UUID)):
+        return str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class FastJSONProvider(JSONProvider):
+
+    """FastJSONProvider
+
+    Compact JSON provider with native ISO-8601 dates, backed by orjson
+    when available.
+
+    """
+
+    mimetype = 'application/json'
+
+    def dumps_bytes(self, obj):
+        if orjson is not None:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
+        kwargs.setdefault('default', _default)
+        kwargs.setdefault('ensure_ascii', False)
+        kwargs.setdefault('separators', (',', ':'))
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,312 @@
+"""In-process Prometheus metrics, rendered in the text format by GET /metrics.
+
+Metrics live in the memory of each process. With several gunicorn workers, a
+scrape is answered by one of them, so every sample carries a `pid` label that
+keeps the series of each worker apart (sum them by pid in queries).
+
+"""
+from bisect import bisect_left
+import os
+import threading
+import time
+
+from flask import g, request
+
+# Default histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+
+    """Metric
+
+    Base of the metric types: a name, help text and samples keyed by label values.
+
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(x, '') for x in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        return (('pid', os.getpid()),) + tuple(zip(self.labelnames, key)) + tuple(extra)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f'{self.name}{_format_labels(self._labels(key))} {_format_value(value)}']
+
+
+class Counter(Metric):
+
+    """Counter
+
+    Monotonically increasing total.
+
+    """
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Sets the total of a count kept by another object, E.g.: copied at scrape time."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Gauge(Metric):
+
+    """Gauge
+
+    Value that is set as a whole, E.g.: at scrape time.
+
+    """
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+
+    """Histogram
+
+    Counts of observations per bucket, with their sum and count.
+
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                # Per bucket (plus +Inf) counts, then sum.
+                sample = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            sample[index] += 1
+            sample[-1] += value
+
+    def _render_sample(self, key, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value[:-1]):
+            cumulative += count
+            labels = _format_labels(self._labels(key, (('le', _format_value(float(bound))),)))
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self._labels(key))
+        lines.append(f'{self.name}_sum{labels} {_format_value(value[-1])}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def render():
+    """Returns every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+#################################################################################
+# Database pool
+#################################################################################
+
+db_pool_checkout_seconds = Histogram(
+    'db_pool_checkout_seconds',
+    'Time waited to check a connection out of the pool, including connecting.',
+    ('pool',)
+)
+db_pool_checkout_timeouts = Counter(
+    'db_pool_checkout_timeouts_total',
+    'Checkouts that gave up after DB_POOL_TIMEOUT seconds.',
+    ('pool',)
+)
+db_pool_connections = Gauge(
+    'db_pool_connections',
+    'Connections of the pool by state: checked_out (in use), checked_in (idle) and overflow.',
+    ('pool', 'state')
+)
+db_pool_size = Gauge(
+    'db_pool_size',
+    'Configured size of the pool.',
+    ('pool',)
+)
+
+
+#################################################################################
+# Caches
+#################################################################################
+
+cache_hits = Counter(
+    'cache_hits_total',
+    'Lookups served from the cache.',
+    ('cache',)
+)
+cache_misses = Counter(
+    'cache_misses_total',
+    'Lookups not found in the cache (or expired).',
+    ('cache',)
+)
+cache_entries = Gauge(
+    'cache_entries',
+    'Entries held by an in-process cache.',
+    ('cache',)
+)
+
+
+def record_cache_metrics(caches):
+    """Copies the counters of `caches` (name: cache with a stats() method) into the cache metrics."""
+    for name, cache in caches.items():
+        stats = cache.stats()
+        cache_hits.set_total(stats['hits'], cache=name)
+        cache_misses.set_total(stats['misses'], cache=name)
+        if stats.get('size') is not None:
+            cache_entries.set(stats['size'], cache=name)
+
+
+#################################################################################
+# Requests
+#################################################################################
+
+http_request_seconds = Histogram(
+    'http_request_seconds',
+    'Time to handle a request, up to the response headers, by route template.',
+    ('route', 'method', 'status')
+)
+http_request_sql_statements = Histogram(
+    'http_request_sql_statements',
+    'SQL statements executed per request.',
+    ('route', 'method'),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100)
+)
+http_request_db_seconds = Histogram(
+    'http_request_db_seconds',
+    'Time spent executing SQL statements per request.',
+    ('route', 'method')
+)
+http_request_auth_seconds = Histogram(
+    'http_request_auth_seconds',
+    'Time spent verifying the bearer token (requires_auth) per request.',
+    ('route', 'method')
+)
+http_response_bytes = Histogram(
+    'http_response_bytes',
+    'Size of the response body.',
+    ('route', 'method'),
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+)
+
+
+def init_app(app):
+    """Records the request metrics of `app`.
+
+    Requests are labelled by their route template (E.g.: /movies/<int:movie_id>),
+    not their path, so the number of series stays bounded. The SQL statements
+    are counted by the engine event listeners of models.py, and the token
+    verification time by requires_auth, in `g`. The statements run while a
+    streamed body (E.g.: the exports) is sent come after, and are not counted.
+    """
+    @app.before_request
+    def start_request_metrics():
+        g.request_start = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'request_start' not in g:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        method = request.method
+        http_request_seconds.observe(time.perf_counter() - g.request_start,
+                                     route=route, method=method, status=response.status_code)
+        http_request_sql_statements.observe(g.sql_statements, route=route, method=method)
+        http_request_db_seconds.observe(g.sql_seconds, route=route, method=method)
+        if 'auth_seconds' in g:
+            http_request_auth_seconds.observe(g.auth_seconds, route=route, method=method)
+
+        size = response.calculate_content_length()
+        if size is None:
+            # Streamed: counted as it is sent.
+            response.response = _CountedBody(response.response, response.iter_encoded(),
+                                             {'route': route, 'method': method})
+        else:
+            http_response_bytes.observe(size, route=route, method=method)
+        return response
+
+
+class _CountedBody:
+
+    """_CountedBody
+
+    Streamed response body that records its size once it is closed.
+
+    """
+
+    def __init__(self, original, chunks, labels):
+        self.original = original
+        self.chunks = chunks
+        self.labels = labels
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        http_response_bytes.observe(self.size, **self.labels)
+        # It replaces response.response, which must still be closed (E.g.: stream_with_context).
+        if hasattr(self.original, 'close'):
+            self.original.close()
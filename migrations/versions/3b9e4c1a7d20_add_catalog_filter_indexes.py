@@ -0,0 +1,34 @@
+"""add catalog filter indexes
+
+Revision ID: 3b9e4c1a7d20
+Revises: 66d054bb9ab5
+Create Date: 2026-10-18 10:12:45.204811
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9e4c1a7d20'
+down_revision = '66d054bb9ab5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_actor_gender_age', 'actor', ['gender', 'age'], unique=False)
+    op.create_index('ix_actor_age', 'actor', ['age'], unique=False)
+    op.create_index('ix_actor_name_pattern', 'actor', ['name'], unique=False,
+                    postgresql_ops={'name': 'varchar_pattern_ops'})
+    op.create_index('ix_movie_release_date_id', 'movie', ['release_date', 'id'], unique=False)
+    op.create_index('ix_movie_title_pattern', 'movie', ['title'], unique=False,
+                    postgresql_ops={'title': 'varchar_pattern_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_movie_title_pattern', table_name='movie')
+    op.drop_index('ix_movie_release_date_id', table_name='movie')
+    op.drop_index('ix_actor_name_pattern', table_name='actor')
+    op.drop_index('ix_actor_age', table_name='actor')
+    op.drop_index('ix_actor_gender_age', table_name='actor')
@@ -0,0 +1,28 @@
+"""add relationship indexes
+
+Revision ID: 5e1c7b3f9a28
+Revises: f3b8a2d6c914
+Create Date: 2026-10-18 15:31:06.518942
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e1c7b3f9a28'
+down_revision = 'f3b8a2d6c914'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # unique_casting leads with movie_id, so actor -> movies lookups need their own index.
+    op.create_index('ix_casting_actor_id_movie_id', 'casting', ['actor_id', 'movie_id'], unique=False)
+    # ix_actor_name_pattern (varchar_pattern_ops) only serves LIKE prefixes on Postgres, not ORDER BY name.
+    op.create_index('ix_actor_name', 'actor', ['name'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_actor_name', table_name='actor')
+    op.drop_index('ix_casting_actor_id_movie_id', table_name='casting')
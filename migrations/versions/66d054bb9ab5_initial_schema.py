@@ -0,0 +1,47 @@
+"""initial schema
+
+Revision ID: 66d054bb9ab5
+Revises: 
+Create Date: 2023-01-08 18:42:31.512014
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '66d054bb9ab5'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('actor',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('age', sa.Integer(), nullable=True),
+    sa.Column('gender', sa.String(length=1), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('movie',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=256), nullable=True),
+    sa.Column('release_date', sa.Date(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('casting',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('movie_id', sa.Integer(), nullable=False),
+    sa.Column('actor_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['actor_id'], ['actor.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['movie_id'], ['movie.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('movie_id', 'actor_id', name='unique_casting')
+    )
+
+
+def downgrade():
+    op.drop_table('casting')
+    op.drop_table('movie')
+    op.drop_table('actor')
@@ -0,0 +1,61 @@
+"""add search indexes
+
+Revision ID: 8c2f5e9a1b47
+Revises: 3b9e4c1a7d20
+Create Date: 2026-10-18 11:03:17.640233
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2f5e9a1b47'
+down_revision = '3b9e4c1a7d20'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = {
+    'movie': 'title',
+    'actor': 'name'
+}
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, column in SEARCH_COLUMNS.items():
+            op.execute(f"CREATE INDEX ix_{table}_{column}_tsv ON {table} "
+                       f"USING gin (to_tsvector('simple', {column}))")
+            op.execute(f'CREATE INDEX ix_{table}_{column}_trgm ON {table} '
+                       f'USING gin ({column} gin_trgm_ops)')
+    elif dialect == 'sqlite':
+        for table, column in SEARCH_COLUMNS.items():
+            fts = f'{table}_fts'
+            op.execute(f"CREATE VIRTUAL TABLE {fts} USING fts5("
+                       f"{column}, content='{table}', content_rowid='id', "
+                       f"tokenize='unicode61 remove_diacritics 2')")
+            op.execute(f'CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN '
+                       f'INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END')
+            op.execute(f'CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN '
+                       f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END")
+            op.execute(f'CREATE TRIGGER {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN '
+                       f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+                       f'INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END')
+            op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    for table, column in SEARCH_COLUMNS.items():
+        if dialect == 'postgresql':
+            op.drop_index(f'ix_{table}_{column}_trgm', table_name=table)
+            op.drop_index(f'ix_{table}_{column}_tsv', table_name=table)
+        elif dialect == 'sqlite':
+            fts = f'{table}_fts'
+            for trigger in ('ai', 'ad', 'au'):
+                op.execute(f'DROP TRIGGER {fts}_{trigger}')
+            op.execute(f'DROP TABLE {fts}')
@@ -0,0 +1,28 @@
+"""add table_stat
+
+Revision ID: d41a7f3e9c05
+Revises: 8c2f5e9a1b47
+Create Date: 2026-10-18 12:20:08.731559
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41a7f3e9c05'
+down_revision = '8c2f5e9a1b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('table_stat',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('table_stat')
@@ -0,0 +1,95 @@
+"""add counters
+
+Revision ID: f3b8a2d6c914
+Revises: d41a7f3e9c05
+Create Date: 2026-10-18 14:42:51.208317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8a2d6c914'
+down_revision = 'd41a7f3e9c05'
+branch_labels = None
+depends_on = None
+
+COUNTER_COLUMNS = {
+    'movie': 'cast_count',
+    'actor': 'credit_count'
+}
+COUNTED_TABLES = ('movie', 'actor', 'casting')
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    op.add_column('table_stat', sa.Column('row_count', sa.Integer(), server_default='0', nullable=False))
+    for table, column in COUNTER_COLUMNS.items():
+        op.add_column(table, sa.Column(column, sa.Integer(), server_default='0', nullable=False))
+        op.create_index(f'ix_{table}_{column}', table, [column, 'id'], unique=False)
+
+    # Backfill, then keep up to date with triggers.
+    for table, column in COUNTER_COLUMNS.items():
+        op.execute(f'UPDATE {table} SET {column} = '
+                   f'(SELECT count(*) FROM casting WHERE casting.{table}_id = {table}.id)')
+    for table in COUNTED_TABLES:
+        op.execute(f"INSERT INTO table_stat (name, version, row_count) SELECT '{table}', 0, count(*) FROM {table} "
+                   f'WHERE true ON CONFLICT (name) DO UPDATE SET row_count = excluded.row_count')
+
+    if dialect == 'postgresql':
+        for operation, rows, sign in (('insert', 'new_rows', '+'), ('delete', 'old_rows', '-')):
+            delta = 'count(*)' if sign == '+' else '-count(*)'
+            op.execute(f'CREATE FUNCTION count_rows_{operation}() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN '
+                       f'INSERT INTO table_stat (name, version, row_count) '
+                       f'SELECT TG_TABLE_NAME, 0, {delta} FROM {rows} '
+                       f'ON CONFLICT (name) DO UPDATE SET row_count = table_stat.row_count + excluded.row_count; '
+                       f'RETURN NULL; END $$')
+            updates = ''.join(
+                f'UPDATE {table} SET {column} = {table}.{column} {sign} n.count '
+                f'FROM (SELECT {table}_id, count(*) AS count FROM {rows} GROUP BY {table}_id) AS n '
+                f'WHERE {table}.id = n.{table}_id; '
+                for table, column in COUNTER_COLUMNS.items()
+            )
+            op.execute(f'CREATE FUNCTION casting_counts_{operation}() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN '
+                       f'{updates}RETURN NULL; END $$')
+
+            transition = 'NEW TABLE AS new_rows' if operation == 'insert' else 'OLD TABLE AS old_rows'
+            for table in COUNTED_TABLES:
+                op.execute(f'CREATE TRIGGER {table}_rows_{operation} AFTER {operation.upper()} ON {table} '
+                           f'REFERENCING {transition} FOR EACH STATEMENT EXECUTE FUNCTION count_rows_{operation}()')
+            op.execute(f'CREATE TRIGGER casting_counts_{operation} AFTER {operation.upper()} ON casting '
+                       f'REFERENCING {transition} FOR EACH STATEMENT EXECUTE FUNCTION casting_counts_{operation}()')
+    elif dialect == 'sqlite':
+        for operation, row, sign, delta in (('insert', 'new', '+', 1), ('delete', 'old', '-', -1)):
+            for table in COUNTED_TABLES:
+                updates = ''
+                if table == 'casting':
+                    updates = ''.join(
+                        f'UPDATE {x} SET {column} = {column} {sign} 1 WHERE id = {row}.{x}_id; '
+                        for x, column in COUNTER_COLUMNS.items()
+                    )
+                op.execute(f'CREATE TRIGGER {table}_counts_{operation} AFTER {operation.upper()} ON {table} '
+                           f"BEGIN INSERT INTO table_stat (name, version, row_count) VALUES ('{table}', 0, {delta}) "
+                           f'ON CONFLICT (name) DO UPDATE SET row_count = row_count {sign} 1; {updates}END')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    for operation in ('insert', 'delete'):
+        if dialect == 'postgresql':
+            for table in COUNTED_TABLES:
+                op.execute(f'DROP TRIGGER {table}_rows_{operation} ON {table}')
+            op.execute(f'DROP TRIGGER casting_counts_{operation} ON casting')
+            op.execute(f'DROP FUNCTION count_rows_{operation}()')
+            op.execute(f'DROP FUNCTION casting_counts_{operation}()')
+        elif dialect == 'sqlite':
+            for table in COUNTED_TABLES:
+                op.execute(f'DROP TRIGGER {table}_counts_{operation}')
+
+    for table, column in COUNTER_COLUMNS.items():
+        op.drop_index(f'ix_{table}_{column}', table_name=table)
+        op.drop_column(table, column)
+    op.drop_column('table_stat', 'row_count')
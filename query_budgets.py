@@ -0,0 +1,78 @@
+"""Per-endpoint SQL statement budgets, and detection of repeated (N+1) statements.
+
+Every endpoint declares, with @query_budget(n), the most SQL statements one
+request to it may run, whatever the size of the data. QUERY_BUDGET_MODE (or
+the app config key of the same name) selects what happens when a request
+runs more, or runs the same statement more than QUERY_REPEAT_LIMIT times,
+which is how an N+1 query (one statement per record) shows:
+
+    off     nothing is recorded.
+    warn    a warning naming the route and the statement is logged (the default).
+    assert  QueryBudgetExceeded is raised, failing the test that sent the request.
+
+Statements are recorded by the engine event listeners of models.py. Those of a
+streamed body (E.g.: the exports) run after the check and are not counted.
+
+"""
+from collections import Counter
+import os
+
+from flask import current_app, g, request
+
+QUERY_BUDGET_MODE = os.environ.get('QUERY_BUDGET_MODE', 'warn')
+# Times one statement may run per request before it is reported as repeated.
+QUERY_REPEAT_LIMIT = int(os.environ.get('QUERY_REPEAT_LIMIT', 2))
+# Characters of a statement quoted in the reports.
+STATEMENT_PREVIEW = 200
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(statements):
+    """Decorator declaring the most SQL statements a request to the endpoint may run.
+
+    Put it right under @app.route, so it annotates the registered view function.
+    """
+    def query_budget_decorator(f):
+        f.query_budget = statements
+        return f
+
+    return query_budget_decorator
+
+
+def get_budget(app, endpoint):
+    """Returns the budget declared by the view function of `endpoint`, or None."""
+    return getattr(app.view_functions.get(endpoint), 'query_budget', None)
+
+
+def init_app(app):
+    """Checks the requests of `app` against the budgets of their endpoints."""
+    @app.before_request
+    def start_query_budget():
+        if current_app.config.get('QUERY_BUDGET_MODE', QUERY_BUDGET_MODE) != 'off':
+            g.sql_statement_counts = Counter()
+
+    @app.after_request
+    def check_query_budget(response):
+        counts = g.get('sql_statement_counts')
+        if counts is None:
+            return response
+
+        route = f'{request.method} {request.url_rule.rule if request.url_rule is not None else request.path}'
+        problems = []
+        budget = get_budget(current_app, request.endpoint)
+        total = sum(counts.values())
+        if budget is not None and total > budget:
+            problems.append(f'{route} ran {total} SQL statements, over its budget of {budget}.')
+        for statement, count in counts.items():
+            if count > QUERY_REPEAT_LIMIT:
+                problems.append(f'{route} ran the same SQL statement {count} times: '
+                                f'{" ".join(statement.split())[:STATEMENT_PREVIEW]}')
+
+        if problems and current_app.config.get('QUERY_BUDGET_MODE', QUERY_BUDGET_MODE) == 'assert':
+            raise QueryBudgetExceeded('\n'.join(problems))
+        for problem in problems:
+            current_app.logger.warning(problem)
+        return response
@@ -18,10 +18,12 @@ E.g.:
 """
 import os
 import unittest
+from unittest import mock
 import json
 
-from app import create_app
+from app import create_app, MAX_BULK_ITEMS
 from models import Actor, Movie, Casting
+from query_budgets import get_budget
 
 
 class CastingAgencyTestCase(unittest.TestCase):
@@ -31,6 +33,8 @@ class CastingAgencyTestCase(unittest.TestCase):
     def setUp(self) -> None:
         """Define test variables and initialize app."""
         self.app = create_app()
+        # Fail any request that runs more SQL statements than its endpoint's budget, or repeats one.
+        self.app.config.update(TESTING=True, QUERY_BUDGET_MODE='assert')
         self.client = self.app.test_client
         self.headers = {'Content-Type': 'application/json'}
         self.set_ep_tokens()
@@ -101,6 +105,17 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertIn('Missing required', data.get('message'))
 
+    def test_400_create_movie_invalid_release_date(self):
+        res = self.client().post('/movies', json={
+            'title': 'Spider-Man: Homecoming',
+            'release_date': '07/07/2017'
+        }, headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertIn('release_date', data.get('message'))
+
     def test_405_movie_creation_not_allowed(self):
         res = self.client().post('/movies/45', json=self.new_movie, headers=self.headers)
         data = json.loads(res.data)
@@ -122,6 +137,62 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertTrue(data['total_movies'] > self.ITEMS_PER_PAGE)
         self.assertTrue(len(data['movies']) == self.ITEMS_PER_PAGE)
 
+    def test_get_paginated_movies_second_page(self):
+        first_res = self.client().get('/movies?page=1', headers=self.headers)
+        first_data = json.loads(first_res.data)
+        res = self.client().get('/movies?page=2', headers=self.headers)
+        data = json.loads(res.data)
+        first_ids = set(x['id'] for x in first_data['movies'])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_movies'], first_data['total_movies'])
+        self.assertFalse(first_ids.intersection(x['id'] for x in data['movies']))
+
+    def test_get_movies_by_cursor(self):
+        res = self.client().get('/movies', headers=self.headers)
+        total_movies = json.loads(res.data)['total_movies']
+
+        movie_ids = []
+        cursor = ''
+        while cursor is not None:
+            res = self.client().get(f'/movies?cursor={cursor}', headers=self.headers)
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['success'], True)
+            movie_ids.extend(x['id'] for x in data['movies'])
+            cursor = data['next_cursor']
+
+        self.assertEqual(len(movie_ids), total_movies)
+        self.assertEqual(len(set(movie_ids)), total_movies)
+
+    def test_400_get_movies_invalid_cursor(self):
+        res = self.client().get('/movies?cursor=not-a-cursor', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Invalid cursor.')
+
+    def test_get_movies_by_release_date_range(self):
+        all_res = self.client().get('/movies', headers=self.headers)
+        all_data = json.loads(all_res.data)
+        res = self.client().get('/movies?release_date_from=2000-01-01&release_date_to=2019-12-31',
+                                headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['total_movies'] < all_data['total_movies'])
+
+    def test_400_get_movies_invalid_date_filter(self):
+        res = self.client().get('/movies?release_date_from=yesterday', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertIn('release_date_from', data['message'])
+
     def test_404_sent_request_beyond_valid_page(self):
         res = self.client().get('/movies?page=999', headers=self.headers)
         data = json.loads(res.data)
@@ -138,6 +209,14 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertIn('1995', data['movie']['release_date'])
 
+    def test_400_update_movie_invalid_release_date(self):
+        res = self.client().patch('/movies/1', json={'release_date': 'yesterday'}, headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertIn('release_date', data.get('message'))
+
     def test_delete_movie(self):
         with self.app.app_context():
             # Create a test movie to delete.
@@ -155,6 +234,30 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data['deleted_id'], test_id)
         self.assertEqual(movie, None)
 
+    def test_delete_movie_cascades_castings(self):
+        with self.app.app_context():
+            test_movie = Movie(**self.new_movie)
+            test_movie.insert()
+            test_movie_id = test_movie.id
+            test_casting = Casting(movie_id=test_movie_id, actor_id=1)
+            test_casting.insert()
+            test_casting_id = test_casting.id
+
+        res = self.client().delete(f'/movies/{test_movie_id}', headers=self.headers)
+
+        with self.app.app_context():
+            casting = Casting.query.filter(Casting.id == test_casting_id).one_or_none()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(casting, None)
+
+    def test_404_update_non_existing_movie(self):
+        res = self.client().patch('/movies/100000', json={'title': 'Missing'}, headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
     def test_422_if_deleting_non_existing_movies(self):
         res = self.client().delete('/movies/1000', headers=self.headers)
         data = json.loads(res.data)
@@ -171,6 +274,50 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(data['movie']['id'], 1)
 
+    def test_get_movie_by_id_with_actors(self):
+        res = self.client().get('/movies/1?include=actors', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual([x['id'] for x in data['movie']['actors']], [1, 2])
+
+    def test_get_movies_with_actors(self):
+        res = self.client().get('/movies?include=actors', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(all('actors' in x for x in data['movies']))
+        self.assertTrue(any(x['actors'] for x in data['movies']))
+
+    def test_400_get_movies_invalid_include(self):
+        res = self.client().get('/movies?include=movies', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Invalid include: movies')
+
+    def test_304_get_movie_by_id_not_modified(self):
+        res = self.client().get('/movies/1', headers=self.headers)
+        etag = res.headers['ETag']
+        res = self.client().get('/movies/1', headers={**self.headers, 'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(res.headers['ETag'], etag)
+        self.assertIn('private', res.headers['Cache-Control'])
+
+    def test_etag_changes_after_update(self):
+        res = self.client().get('/movies', headers=self.headers)
+        etag = res.headers['ETag']
+        self.client().patch('/movies/1', json={'release_date': '1994-10-04'}, headers=self.headers)
+        res = self.client().get('/movies', headers={**self.headers, 'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
     def test_get_movie_by_actor(self):
         """Tests both movie_by_actor and actor_by_movie."""
         actor_id = 1
@@ -190,6 +337,90 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(actor_data['success'], True)
         self.assertTrue(actor_data['actors'])
         self.assertTrue(found_actor)
+        self.assertGreaterEqual(actor_data['total_actors'], len(actor_data['actors']))
+        self.assertGreaterEqual(movie_data['total_movies'], len(movie_data['movies']))
+
+    def test_search(self):
+        res = self.client().get('/search?q=spider', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['results'])
+        self.assertTrue(all('Spider' in x['title'] for x in data['results'] if x['type'] == 'movie'))
+        self.assertGreaterEqual(data['total_results'], len(data['results']))
+
+    def test_search_finds_updated_name(self):
+        with self.app.app_context():
+            test_actor = Actor(**self.new_actor)
+            test_actor.insert()
+            test_id = test_actor.id
+            test_actor.name = 'Zendaya Coleman'
+            test_actor.update()
+
+        res = self.client().get('/search?q=zendaya', headers=self.headers)
+        data = json.loads(res.data)
+
+        # Clean up
+        with self.app.app_context():
+            Actor.query.filter(Actor.id == test_id).one().delete()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(test_id, [x['id'] for x in data['results'] if x['type'] == 'actor'])
+
+    def test_400_search_without_query(self):
+        res = self.client().get('/search', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertIn('search query is required', data['message'])
+
+    def test_get_stats(self):
+        res = self.client().get('/stats?limit=3', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['top_actors']), 3)
+        self.assertEqual(data['top_actors'][0]['name'], 'Tom Hanks')
+        self.assertEqual(sum(x['count'] for x in data['cast_count_distribution']), data['total_movies'])
+        self.assertEqual(sum(x['cast_count'] * x['count'] for x in data['cast_count_distribution']),
+                         data['total_castings'])
+
+    def test_stats_count_new_casting(self):
+        res = self.client().get('/stats?limit=1', headers=self.headers)
+        total_castings = json.loads(res.data)['total_castings']
+
+        res = self.client().post('/castings', json={'movie_id': 8, 'actor_id': 1}, headers=self.headers)
+        casting_id = json.loads(res.data)['created_id']
+        res = self.client().get('/stats?limit=1', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_castings'], total_castings + 1)
+
+        # Clean up
+        with self.app.app_context():
+            Casting.query.filter(Casting.id == casting_id).one().delete()
+
+    def test_400_get_stats_invalid_limit(self):
+        res = self.client().get('/stats?limit=0', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_export_actors(self):
+        res = self.client().get('/export/actors', headers=self.headers)
+        records = [json.loads(x) for x in res.data.decode().splitlines()]
+        list_res = self.client().get('/actors', headers=self.headers)
+        list_data = json.loads(list_res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(records), list_data['total_actors'])
+        self.assertEqual(records[:len(list_data['actors'])], list_data['actors'])
 
     def test_create_actor(self):
         res = self.client().post('/actors', json=self.new_actor, headers=self.headers)
@@ -236,6 +467,33 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertTrue(data['total_actors'] > self.ITEMS_PER_PAGE)
         self.assertTrue(len(data['actors']) == self.ITEMS_PER_PAGE)
 
+    def test_get_actors_filtered_and_sorted(self):
+        res = self.client().get('/actors?gender=M&min_age=40&max_age=80&sort=-age,name', headers=self.headers)
+        data = json.loads(res.data)
+        ages = [x['age'] for x in data['actors']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(all(x['gender'] == 'M' for x in data['actors']))
+        self.assertTrue(all(40 <= x <= 80 for x in ages))
+        self.assertEqual(ages, sorted(ages, reverse=True))
+
+    def test_get_actors_by_name_prefix(self):
+        res = self.client().get('/actors?name=Morgan', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(all(x['name'].startswith('Morgan') for x in data['actors']))
+        self.assertEqual(data['total_actors'], len(data['actors']))
+
+    def test_400_get_actors_invalid_sort(self):
+        res = self.client().get('/actors?sort=password', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertIn('Invalid sort field', data['message'])
+
     def test_update_actor(self):
         res = self.client().patch('/actors/8', json={'gender': 'F'}, headers=self.headers)
         data = json.loads(res.data)
@@ -277,6 +535,14 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(data['actor']['id'], 1)
 
+    def test_get_actor_by_id_with_movies(self):
+        res = self.client().get('/actors/1?include=movies', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual([x['id'] for x in data['actor']['movies']], [1])
+
     def test_create_casting(self):
         movie_res = self.client().post('/movies', json=self.new_movie, headers=self.headers)
         movie_data = json.loads(movie_res.data)
@@ -291,6 +557,7 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(casting_res.status_code, 201)
         self.assertEqual(casting_data['success'], True)
         self.assertTrue(casting_data['created_id'])
+        self.assertEqual(casting_data['created'], True)
 
         # Clean up
         with self.app.app_context():
@@ -298,8 +565,8 @@ class CastingAgencyTestCase(unittest.TestCase):
             Actor.query.filter(Actor.id == actor_data['created_id']).one().delete()
             Movie.query.filter(Movie.id == movie_data['created_id']).one().delete()
 
-    def test_integrity_error_casting(self):
-        """Test create casting that already exists"""
+    def test_create_existing_casting_is_idempotent(self):
+        """Test create casting that already exists returns the existing casting"""
         movie_res = self.client().post('/movies', json=self.new_movie, headers=self.headers)
         movie_data = json.loads(movie_res.data)
         actor_res = self.client().post('/actors', json=self.new_actor, headers=self.headers)
@@ -316,9 +583,10 @@ class CastingAgencyTestCase(unittest.TestCase):
         }, headers=self.headers)
         casting_data = json.loads(casting_res.data)
 
-        self.assertEqual(casting_res.status_code, 400)
-        self.assertEqual(casting_data['success'], False)
-        self.assertIn('already exists', casting_data['message'])
+        self.assertEqual(casting_res.status_code, 200)
+        self.assertEqual(casting_data['success'], True)
+        self.assertEqual(casting_data['created_id'], casting_created_id)
+        self.assertEqual(casting_data['created'], False)
 
         # Clean up
         with self.app.app_context():
@@ -326,6 +594,111 @@ class CastingAgencyTestCase(unittest.TestCase):
             Actor.query.filter(Actor.id == actor_data['created_id']).one().delete()
             Movie.query.filter(Movie.id == movie_data['created_id']).one().delete()
 
+    def test_422_create_casting_unknown_movie(self):
+        res = self.client().post('/castings', json={'movie_id': 100000, 'actor_id': 1}, headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+    def test_create_actors_bulk(self):
+        res = self.client().post('/actors/bulk', json=[
+            self.new_actor,
+            {'name': 'Zendaya', 'age': 'unknown', 'gender': 'F'},
+            self.new_actor
+        ], headers=self.headers)
+        data = json.loads(res.data)
+
+        # Clean up
+        with self.app.app_context():
+            for created_id in filter(None, data['created_ids']):
+                Actor.query.filter(Actor.id == created_id).one().delete()
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['created_ids'][0])
+        self.assertIsNone(data['created_ids'][1])
+        self.assertTrue(data['created_ids'][2])
+        self.assertEqual([x['index'] for x in data['errors']], [1])
+
+    def test_400_create_movies_bulk_no_valid_items(self):
+        res = self.client().post('/movies/bulk', json=[{'title': 'Dune'}], headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['created_ids'], [None])
+        self.assertIn('Missing required', data['errors'][0]['message'])
+
+    def test_create_castings_bulk(self):
+        with self.app.app_context():
+            test_movie = Movie(**self.new_movie)
+            test_movie.insert()
+            test_movie_id = test_movie.id
+
+        res = self.client().post('/castings/bulk', json=[
+            {'movie_id': test_movie_id, 'actor_id': 1},
+            {'movie_id': test_movie_id, 'actor_id': 1},
+            {'movie_id': test_movie_id, 'actor_id': 2}
+        ], headers=self.headers)
+        data = json.loads(res.data)
+
+        # Clean up
+        with self.app.app_context():
+            for created_id in filter(None, data['created_ids']):
+                Casting.query.filter(Casting.id == created_id).one().delete()
+            Movie.query.filter(Movie.id == test_movie_id).one().delete()
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data['success'], True)
+        self.assertIsNone(data['created_ids'][1])
+        self.assertIn('already exists', data['errors'][0]['message'])
+
+    def test_400_create_castings_bulk_existing_pairs(self):
+        with self.app.app_context():
+            test_movie = Movie(**self.new_movie)
+            test_movie.insert()
+            test_movie_id = test_movie.id
+            Casting(movie_id=test_movie_id, actor_id=1).insert()
+
+        res = self.client().post('/castings/bulk', json=[
+            {'movie_id': test_movie_id, 'actor_id': 1},
+            {'movie_id': 100000, 'actor_id': 1}
+        ], headers=self.headers)
+        data = json.loads(res.data)
+
+        # Clean up
+        with self.app.app_context():
+            Movie.query.filter(Movie.id == test_movie_id).one().delete()
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual([x['index'] for x in data['errors']], [0, 1])
+        self.assertIn('already exists', data['errors'][0]['message'])
+
+    def test_create_castings_bulk_max_items_within_query_budget(self):
+        # 50 movies x 20 actors: MAX_BULK_ITEMS pairs, over several insert chunks,
+        # with an existing pair in the first and the last chunk. Fails under assert mode if over budget.
+        res = self.client().post('/movies/bulk', json=[self.new_movie] * 50, headers=self.headers)
+        movie_ids = json.loads(res.data)['created_ids']
+        with self.app.app_context():
+            Casting(movie_id=movie_ids[0], actor_id=1).insert()
+            Casting(movie_id=movie_ids[-1], actor_id=20).insert()
+
+        res = self.client().post('/castings/bulk', json=[
+            {'movie_id': movie_id, 'actor_id': actor_id} for movie_id in movie_ids for actor_id in range(1, 21)
+        ], headers=self.headers)
+        data = json.loads(res.data)
+
+        # Clean up (the castings go with their movies)
+        with self.app.app_context():
+            for movie_id in movie_ids:
+                Movie.query.filter(Movie.id == movie_id).one().delete()
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(len(data['created_ids']), MAX_BULK_ITEMS)
+        self.assertEqual([x['index'] for x in data['errors']], [0, MAX_BULK_ITEMS - 1])
+
     def test_delete_casting(self):
         with self.app.app_context():
             # Create a test casting to delete.
@@ -353,6 +726,26 @@ class CastingAgencyTestCase(unittest.TestCase):
             Movie.query.filter(Movie.id == test_movie_id).one().delete()
             Actor.query.filter(Actor.id == test_actor_id).one().delete()
 
+    def test_every_endpoint_declares_a_query_budget(self):
+        for rule in self.app.url_map.iter_rules():
+            if rule.endpoint != 'static':
+                self.assertIsNotNone(get_budget(self.app, rule.endpoint), rule.rule)
+
+    def test_404_metrics_disabled_without_token(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop('METRICS_TOKEN', None)
+            res = self.client().get('/metrics')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_401_metrics_invalid_token(self):
+        with mock.patch.dict(os.environ, {'METRICS_TOKEN': 'secret'}):
+            res = self.client().get('/metrics', headers={'Authorization': 'Bearer wrong'})
+            ok = self.client().get('/metrics', headers={'Authorization': 'Bearer secret'})
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(ok.status_code, 200)
+
     # RBAC Testing with different tokens
     def test_z000_401_get_movies_no_token(self):
         res = self.client().get('/movies')
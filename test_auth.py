@@ -0,0 +1,231 @@
+"""Auth Unit Tests
+
+These tests exercise the token verification helpers in auth/auth.py and
+do not require a database or live Auth0 tokens.
+
+"""
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+os.environ.setdefault('AUTH0_DOMAIN', 'example.auth0.com')
+os.environ.setdefault('API_AUDIENCE', 'casting')
+
+import rsa
+from jose import jwk, jwt
+
+from auth import auth
+
+PUBLIC_KEY, PRIVATE_KEY = rsa.newkeys(1024)
+PUBLIC_JWK = {k: v.decode() if isinstance(v, bytes) else v
+              for k, v in jwk.construct(PUBLIC_KEY.save_pkcs1(), 'RS256').to_dict().items()}
+
+
+def make_token(kid='key-1', **claims):
+    """Returns an RS256 token signed with the test key."""
+    now = int(time.time())
+    claims = {
+        'iss': f'https://{auth.AUTH0_DOMAIN}/',
+        'aud': auth.API_AUDIENCE,
+        'iat': now,
+        'exp': now + 60,
+        'permissions': ['get:movies'],
+        **claims
+    }
+    return jwt.encode(claims, PRIVATE_KEY.save_pkcs1(), algorithm='RS256', headers={'kid': kid})
+
+
+class FakeJWKSEndpoint:
+
+    """Stands in for urlopen(), counting how many times the key set is fetched."""
+
+    def __init__(self, kids=('key-1',)):
+        self.kids = list(kids)
+        self.calls = 0
+        self.urls = []
+        self.fail = False
+        self.delay = 0
+
+    def __call__(self, url, timeout=None):
+        self.calls += 1
+        self.urls.append(url)
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            raise OSError('connection refused')
+        response = mock.Mock()
+        response.read.return_value = auth.json.dumps({'keys': [
+            {**PUBLIC_JWK, 'kid': kid, 'use': 'sig'}
+            for kid in self.kids
+        ]}).encode()
+        return response
+
+
+class JWKSStoreTestCase(unittest.TestCase):
+
+    """This class represents the JWKS key store test case."""
+
+    def setUp(self) -> None:
+        self.endpoint = FakeJWKSEndpoint()
+        patcher = mock.patch.object(auth, 'urlopen', self.endpoint)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = auth.JWKSStore('https://example.auth0.com/.well-known/jwks.json',
+                                    ttl=60, min_refresh_interval=10)
+
+    def test_key_set_is_fetched_once_within_ttl(self):
+        for _ in range(5):
+            self.assertIsNotNone(self.store.get_key('key-1'))
+
+        self.assertEqual(self.endpoint.calls, 1)
+
+    def test_keys_are_prebuilt_public_key_objects(self):
+        key = self.store.get_key('key-1')
+
+        self.assertIsInstance(key, jwk.Key)
+        self.assertIs(self.store.get_key('key-1'), key)
+
+    def test_key_set_is_refreshed_after_ttl(self):
+        self.store.get_key('key-1')
+        self.store._fetched_at -= 61
+        self.store._attempted_at -= 61
+        self.store.get_key('key-1')
+
+        self.assertEqual(self.endpoint.calls, 2)
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        self.store.get_key('key-1')
+        for _ in range(5):
+            self.assertIsNone(self.store.get_key('unknown'))
+
+        self.assertEqual(self.endpoint.calls, 1)
+
+    def test_unknown_kid_triggers_refresh_for_rotated_key(self):
+        self.store.get_key('key-1')
+        self.store._attempted_at -= 10
+        self.endpoint.kids.append('key-2')
+
+        self.assertIsNotNone(self.store.get_key('key-2'))
+        self.assertEqual(self.endpoint.calls, 2)
+
+    def test_default_url_is_read_from_environment_when_fetching(self):
+        store = auth.JWKSStore()
+        with mock.patch.dict(os.environ, {'AUTH0_DOMAIN': 'tenant.example.com'}):
+            store.get_key('key-1')
+
+        self.assertEqual(self.endpoint.urls, ['https://tenant.example.com/.well-known/jwks.json'])
+
+    def test_last_good_key_set_is_kept_when_refresh_fails(self):
+        self.store.get_key('key-1')
+        self.store._fetched_at -= 61
+        self.store._attempted_at -= 61
+        self.endpoint.fail = True
+
+        self.assertIsNotNone(self.store.get_key('key-1'))
+        self.assertEqual(self.endpoint.calls, 2)
+
+    def test_concurrent_refreshes_are_single_flight(self):
+        self.endpoint.delay = 0.1
+        threads = [threading.Thread(target=self.store.get_key, args=('key-1',)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.endpoint.calls, 1)
+
+
+class TokenCacheTestCase(unittest.TestCase):
+
+    """This class represents the verified token cache test case."""
+
+    def setUp(self) -> None:
+        self.kids = {'key-1'}
+        key_store = mock.Mock()
+        key_store.has_key.side_effect = lambda kid: kid in self.kids
+        self.cache = auth.TokenCache(key_store, maxsize=2)
+        self.payload = {'exp': time.time() + 60, 'permissions': ['get:movies']}
+
+    def test_cached_payload_is_returned(self):
+        self.assertIsNone(self.cache.get('token'))
+        self.cache.put('token', self.payload, 'key-1')
+
+        self.assertIs(self.cache.get('token'), self.payload)
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_expired_payload_is_evicted(self):
+        self.cache.put('token', {'exp': time.time() - 1}, 'key-1')
+
+        self.assertIsNone(self.cache.get('token'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_payload_is_evicted_when_signing_key_rotates(self):
+        self.cache.put('token', self.payload, 'key-1')
+        self.kids = {'key-2'}
+
+        self.assertIsNone(self.cache.get('token'))
+
+    def test_least_recently_used_payload_is_evicted(self):
+        self.cache.put('token-1', self.payload, 'key-1')
+        self.cache.put('token-2', self.payload, 'key-1')
+        self.cache.get('token-1')
+        self.cache.put('token-3', self.payload, 'key-1')
+
+        self.assertIsNotNone(self.cache.get('token-1'))
+        self.assertIsNone(self.cache.get('token-2'))
+        self.assertIsNotNone(self.cache.get('token-3'))
+
+    def test_payload_without_expiry_is_not_cached(self):
+        self.cache.put('token', {'permissions': []}, 'key-1')
+
+        self.assertIsNone(self.cache.get('token'))
+
+
+class VerifyDecodeJWTTestCase(unittest.TestCase):
+
+    """This class represents the verify_decode_jwt test case."""
+
+    def setUp(self) -> None:
+        self.endpoint = FakeJWKSEndpoint()
+        store = auth.JWKSStore('https://example.auth0.com/.well-known/jwks.json')
+        patchers = [
+            mock.patch.object(auth, 'urlopen', self.endpoint),
+            mock.patch.object(auth, 'jwks_store', store),
+            mock.patch.object(auth, 'token_cache', auth.TokenCache(store))
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_verify_decode_jwt(self):
+        payload = auth.verify_decode_jwt(make_token())
+
+        self.assertEqual(payload['permissions'], ['get:movies'])
+        self.assertTrue(auth.check_permissions('get:movies', payload))
+
+    def test_repeat_token_is_served_from_cache(self):
+        token = make_token()
+        auth.verify_decode_jwt(token)
+        with mock.patch.object(auth.jwt, 'decode') as decode:
+            auth.verify_decode_jwt(token)
+
+        decode.assert_not_called()
+        self.assertEqual(auth.token_cache.stats()['hits'], 1)
+
+    def test_unknown_kid_is_rejected(self):
+        with self.assertRaises(auth.AuthError) as context:
+            auth.verify_decode_jwt(make_token(kid='other'))
+
+        self.assertEqual(context.exception.status_code, 400)
+
+    def test_expired_token_is_rejected(self):
+        with self.assertRaises(auth.AuthError) as context:
+            auth.verify_decode_jwt(make_token(exp=int(time.time()) - 10))
+
+        self.assertEqual(context.exception.error['code'], 'token_expired')
+
+
+if __name__ == '__main__':
+    unittest.main()
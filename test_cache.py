@@ -0,0 +1,73 @@
+"""Entity Cache Unit Tests
+
+These tests exercise cache.py and do not require a database.
+
+"""
+from datetime import date
+import json
+import unittest
+from unittest import mock
+
+from cache import EntityCache, LocalBackend, _decode_date, _encode_date
+
+
+class EntityCacheTestCase(unittest.TestCase):
+
+    """This class represents the entity cache test case."""
+
+    def setUp(self) -> None:
+        self.cache = EntityCache(LocalBackend(ttl=60, maxsize=2))
+        self.movie = {'id': 1, 'title': 'The Shawshank Redemption', 'release_date': date(1994, 10, 4)}
+
+    def test_record_is_loaded_once(self):
+        load = mock.Mock(return_value=self.movie)
+        for _ in range(3):
+            self.assertEqual(self.cache.get_or_load('movie', 1, 1, load), self.movie)
+
+        load.assert_called_once()
+        self.assertEqual(self.cache.stats()['hits'], 2)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_missing_record_is_not_cached(self):
+        load = mock.Mock(return_value=None)
+        self.cache.get_or_load('movie', 1, 1, load)
+        self.cache.get_or_load('movie', 1, 1, load)
+
+        self.assertEqual(load.call_count, 2)
+
+    def test_new_version_is_reloaded(self):
+        self.cache.get_or_load('movie', 1, 1, lambda: self.movie)
+        load = mock.Mock(return_value={**self.movie, 'title': 'Changed'})
+
+        self.assertEqual(self.cache.get_or_load('movie', 2, 1, load)['title'], 'Changed')
+        self.assertEqual(self.cache.get_or_load('movie', 1, 1, load)['title'], self.movie['title'])
+
+    def test_expired_record_is_reloaded(self):
+        self.cache.get_or_load('movie', 1, 1, lambda: self.movie)
+        with mock.patch('cache.time.monotonic', return_value=10 ** 9):
+            load = mock.Mock(return_value=self.movie)
+            self.cache.get_or_load('movie', 1, 1, load)
+
+        load.assert_called_once()
+
+    def test_least_recently_used_record_is_evicted(self):
+        for record_id in (1, 2, 3):
+            self.cache.get_or_load('movie', 1, record_id, lambda: self.movie)
+
+        self.assertEqual(self.cache.stats()['size'], 2)
+        self.assertIsNone(self.cache.backend.get('movie:1:1'))
+
+    def test_cached_record_is_a_copy(self):
+        self.cache.get_or_load('movie', 1, 1, lambda: self.movie)
+        self.cache.get_or_load('movie', 1, 1, lambda: None)['title'] = 'Mutated'
+
+        self.assertEqual(self.cache.get_or_load('movie', 1, 1, lambda: None)['title'], self.movie['title'])
+
+    def test_dates_survive_json_encoding(self):
+        encoded = json.dumps(self.movie, default=_encode_date)
+
+        self.assertEqual(json.loads(encoded, object_hook=_decode_date), self.movie)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+"""Metrics Unit Tests
+
+These tests exercise metrics.py, the request metrics and the metered connection
+pools of models.py, and do not require a database server.
+
+"""
+import os
+import tempfile
+import unittest
+
+from flask import Flask, Response, g
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from auth.auth import TokenCache
+from cache import EntityCache, LocalBackend
+import metrics
+from models import MeteredQueuePool
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    """This class represents the metrics test case."""
+
+    def make(self, metric_class, *args, **kwargs):
+        metric = metric_class(*args, **kwargs)
+        self.addCleanup(metrics.REGISTRY.remove, metric)
+        return metric
+
+    def test_counter(self):
+        counter = self.make(metrics.Counter, 'test_requests_total', 'Requests.', ('route',))
+        counter.inc(route='/movies')
+        counter.inc(2, route='/movies')
+
+        self.assertIn(f'test_requests_total{{pid="{os.getpid()}",route="/movies"}} 3', metrics.render())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.make(metrics.Histogram, 'test_seconds', 'Latency.', buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value)
+
+        lines = histogram.render()
+        pid = os.getpid()
+        self.assertIn(f'test_seconds_bucket{{pid="{pid}",le="0.1"}} 1', lines)
+        self.assertIn(f'test_seconds_bucket{{pid="{pid}",le="1.0"}} 3', lines)
+        self.assertIn(f'test_seconds_bucket{{pid="{pid}",le="+Inf"}} 4', lines)
+        self.assertIn(f'test_seconds_count{{pid="{pid}"}} 4', lines)
+        self.assertIn(f'test_seconds_sum{{pid="{pid}"}} 6.05', lines)
+
+    def test_label_values_are_escaped(self):
+        gauge = self.make(metrics.Gauge, 'test_gauge', 'Gauge.', ('name',))
+        gauge.set(1, name='a "b"\n')
+
+        self.assertIn('name="a \\"b\\"\\n"', gauge.render()[-1])
+
+    def test_cache_metrics_are_copied_from_stats(self):
+        cache = EntityCache(LocalBackend(ttl=30))
+        self.addCleanup(metrics.cache_hits.clear)
+        self.addCleanup(metrics.cache_misses.clear)
+        self.addCleanup(metrics.cache_entries.clear)
+        for _ in range(3):
+            cache.get_or_load('movie', 1, 1, lambda: {'id': 1})
+        metrics.record_cache_metrics({'test': cache})
+
+        pid = os.getpid()
+        text = metrics.render()
+        self.assertIn(f'cache_hits_total{{pid="{pid}",cache="test"}} 2', text)
+        self.assertIn(f'cache_misses_total{{pid="{pid}",cache="test"}} 1', text)
+        self.assertIn(f'cache_entries{{pid="{pid}",cache="test"}} 1', text)
+
+    def test_token_cache_metrics(self):
+        cache = TokenCache(key_store=None)
+        self.addCleanup(metrics.cache_hits.clear)
+        self.addCleanup(metrics.cache_misses.clear)
+        self.addCleanup(metrics.cache_entries.clear)
+        cache.get('token')
+        metrics.record_cache_metrics({'token': cache})
+
+        pid = os.getpid()
+        text = metrics.render()
+        self.assertIn(f'cache_hits_total{{pid="{pid}",cache="token"}} 0', text)
+        self.assertIn(f'cache_misses_total{{pid="{pid}",cache="token"}} 1', text)
+        self.assertIn(f'cache_entries{{pid="{pid}",cache="token"}} 0', text)
+
+
+class MeteredPoolTestCase(unittest.TestCase):
+
+    """This class represents the metered connection pool test case."""
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        pool_class = type('MeteredQueuePool', (MeteredQueuePool,), {'label': 'test'})
+        self.engine = create_engine(f'sqlite:///{directory.name}/test.db', poolclass=pool_class,
+                                    pool_size=1, max_overflow=0, pool_timeout=0.01)
+        self.addCleanup(self.engine.dispose)
+
+    def test_checkout_wait_is_recorded(self):
+        before = metrics.db_pool_checkout_seconds._values.get(('test',), [0] * 15)[:-1]
+        with self.engine.connect():
+            pass
+
+        after = metrics.db_pool_checkout_seconds._values[('test',)][:-1]
+        self.assertEqual(sum(after) - sum(before), 1)
+
+    def test_checkout_timeout_is_counted(self):
+        before = metrics.db_pool_checkout_timeouts._values.get(('test',), 0)
+        with self.engine.connect():
+            with self.assertRaises(PoolTimeoutError):
+                self.engine.connect()
+
+        self.assertEqual(metrics.db_pool_checkout_timeouts._values[('test',)], before + 1)
+
+
+class RequestMetricsTestCase(unittest.TestCase):
+
+    """This class represents the request metrics test case."""
+
+    def setUp(self) -> None:
+        self.app = Flask(__name__)
+        metrics.init_app(self.app)
+        engine = create_engine('sqlite://')
+        self.addCleanup(engine.dispose)
+
+        @self.app.route('/things/<int:thing_id>')
+        def get_thing(thing_id):
+            g.auth_seconds = 0.5
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+                connection.execute(text('SELECT 2'))
+            return 'x' * 300
+
+        @self.app.route('/stream')
+        def stream():
+            return Response(iter(['abc', 'de']))
+
+    def sample(self, metric, **labels):
+        return metric._values[metric._key(labels)]
+
+    def test_request_is_recorded_by_route_template(self):
+        self.app.test_client().get('/things/7')
+
+        labels = {'route': '/things/<int:thing_id>', 'method': 'GET'}
+        self.assertEqual(sum(self.sample(metrics.http_request_seconds, status=200, **labels)[:-1]), 1)
+        self.assertEqual(self.sample(metrics.http_request_sql_statements, **labels)[-1], 2)
+        self.assertGreater(self.sample(metrics.http_request_db_seconds, **labels)[-1], 0)
+        self.assertEqual(self.sample(metrics.http_request_auth_seconds, **labels)[-1], 0.5)
+        self.assertEqual(self.sample(metrics.http_response_bytes, **labels)[-1], 300)
+
+    def test_streamed_response_bytes_are_counted(self):
+        response = self.app.test_client().get('/stream')
+        self.assertEqual(response.data, b'abcde')
+        response.close()
+
+        self.assertEqual(self.sample(metrics.http_response_bytes, route='/stream', method='GET')[-1], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Query Budget Unit Tests
+
+These tests exercise query_budgets.py against an in-memory SQLite database,
+and do not require a database server.
+
+"""
+import unittest
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+import models  # noqa: F401  (its engine event listeners record the statements)
+import query_budgets
+from query_budgets import QueryBudgetExceeded, query_budget
+
+
+class QueryBudgetTestCase(unittest.TestCase):
+
+    """This class represents the query budget test case."""
+
+    def setUp(self) -> None:
+        self.app = Flask(__name__)
+        self.app.config.update(TESTING=True, QUERY_BUDGET_MODE='assert')
+        query_budgets.init_app(self.app)
+        engine = create_engine('sqlite://')
+        self.addCleanup(engine.dispose)
+
+        @self.app.route('/things/<int:count>')
+        @query_budget(2)
+        def get_things(count):
+            with engine.connect() as connection:
+                for i in range(count):
+                    connection.execute(text(f'SELECT {i}'))
+            return ''
+
+        @self.app.route('/n-plus-one')
+        @query_budget(10)
+        def n_plus_one():
+            with engine.connect() as connection:
+                for i in range(3):
+                    connection.execute(text('SELECT :i'), {'i': i})
+            return ''
+
+    def test_within_budget(self):
+        self.assertEqual(self.app.test_client().get('/things/2').status_code, 200)
+
+    def test_over_budget_raises(self):
+        with self.assertRaisesRegex(QueryBudgetExceeded, r'GET /things/<int:count> ran 3 SQL statements'):
+            self.app.test_client().get('/things/3')
+
+    def test_repeated_statement_raises(self):
+        with self.assertRaisesRegex(QueryBudgetExceeded, r'ran the same SQL statement 3 times: SELECT \?'):
+            self.app.test_client().get('/n-plus-one')
+
+    def test_warn_mode_logs(self):
+        self.app.config['QUERY_BUDGET_MODE'] = 'warn'
+        with self.assertLogs(self.app.logger, 'WARNING') as logs:
+            self.assertEqual(self.app.test_client().get('/things/3').status_code, 200)
+
+        self.assertIn('over its budget of 2', logs.output[0])
+
+    def test_off_mode_records_nothing(self):
+        self.app.config['QUERY_BUDGET_MODE'] = 'off'
+        self.assertEqual(self.app.test_client().get('/things/3').status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
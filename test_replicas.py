@@ -0,0 +1,80 @@
+"""Read Replica Unit Tests
+
+These tests route the queries of a Flask app between two SQLite databases, a
+primary and a replica holding different rows, and do not require a database
+server.
+
+"""
+from datetime import date
+import tempfile
+import unittest
+
+from flask import Flask, g
+
+from app import read_replica
+from models import setup_db, db, replicas, Movie
+
+
+class ReplicaTestCase(unittest.TestCase):
+
+    """This class represents the read replica test case."""
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.addCleanup(setattr, replicas, 'keys', [])
+        self.addCleanup(replicas._unhealthy_until.clear)
+
+    def make_app(self, replica_url):
+        app = Flask(__name__)
+        setup_db(app, f'sqlite:///{self.directory}/primary.db', [replica_url])
+        with app.app_context():
+            for engine, title in ((db.engines[None], 'Primary'), (db.engines['replica0'], 'Replica')):
+                try:
+                    db.metadata.create_all(engine)
+                except Exception:
+                    continue
+                with engine.begin() as connection:
+                    connection.execute(Movie.__table__.insert(), {'title': title, 'release_date': date(2020, 1, 1)})
+        return app
+
+    def test_reads_go_to_the_replica(self):
+        app = self.make_app(f'sqlite:///{self.directory}/replica.db')
+        with app.test_request_context():
+            g.read_replica = True
+            self.assertEqual(Movie.query.one().title, 'Replica')
+
+    def test_other_requests_read_from_the_primary(self):
+        app = self.make_app(f'sqlite:///{self.directory}/replica.db')
+        with app.test_request_context():
+            self.assertEqual(Movie.query.one().title, 'Primary')
+
+    def test_reads_after_a_write_go_to_the_primary(self):
+        app = self.make_app(f'sqlite:///{self.directory}/replica.db')
+        with app.test_request_context():
+            g.read_replica = True
+            self.assertEqual(Movie.query.count(), 1)
+            db.session.add(Movie(title='New', release_date=date(2021, 1, 1)))
+            db.session.flush()
+
+            self.assertEqual(Movie.query.count(), 2)
+            self.assertEqual(Movie.query.order_by(Movie.id).first().title, 'Primary')
+
+    def test_unreachable_replica_fails_over_to_the_primary(self):
+        app = self.make_app(f'sqlite:///{self.directory}/missing/replica.db')
+
+        @app.route('/movies')
+        @read_replica
+        def get_movies():
+            return {'titles': [x.title for x in Movie.query.all()]}
+
+        client = app.test_client()
+        self.assertEqual(client.get('/movies').json, {'titles': ['Primary']})
+        self.assertFalse(replicas.is_healthy('replica0'))
+        # Left out while unhealthy, without another failed attempt.
+        self.assertEqual(client.get('/movies').json, {'titles': ['Primary']})
+
+
+if __name__ == '__main__':
+    unittest.main()